@@ -0,0 +1,58 @@
+"""Downloads one file with DIRECT_IO off and on, and reports the wall time,
+the CPU time of the downloading thread and how much of the file is left
+in the page cache afterwards.
+
+The local directory must be on a filesystem that supports O_DIRECT, which
+tmpfs does not; pass --local-dir when the default temporary directory is
+on one.
+
+    python bench/bench_direct_io.py [--size-mb 256] [--local-dir /var/tmp]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+from page_cache import cached_bytes
+
+import main
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--local-dir", default=None)
+    args = parser.parse_args()
+    size = args.size_mb << 20
+    if not hasattr(os, "O_DIRECT"):
+        parser.exit(1, "O_DIRECT is not available on this platform\n")
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory(
+        dir=args.local_dir
+    ) as local:
+        os.mkdir(os.path.join(root, "MXF"))
+        with open(os.path.join(root, "MXF", "big.mxf"), "wb") as f:
+            f.write(os.urandom(size))
+        local_path = os.path.join(local, "big.mxf")
+
+        with ftp_server(root, "MXF"):
+            for direct_io in (False, True):
+                configure(DIRECT_IO=direct_io)
+                ftp = main.connect_ftp()
+                start, start_cpu = time.perf_counter(), time.thread_time()
+                main.retrieve_file(ftp, "big.mxf", local_path, 0, lambda size: None)
+                cpu = time.thread_time() - start_cpu
+                elapsed = time.perf_counter() - start
+                ftp.quit()
+                assert os.path.getsize(local_path) == size
+                print(
+                    f"DIRECT_IO={direct_io!s:5}: {elapsed:.2f}s wall, {cpu:.2f}s CPU, "
+                    f"{cached_bytes(local_path) >> 20} of {args.size_mb} MiB cached"
+                )
+                os.remove(local_path)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,52 @@
+"""Downloads one file with DROP_CACHE off and on, and reports how much of
+it is left in the page cache afterwards.
+
+    python bench/bench_drop_cache.py [--size-mb 256]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+from page_cache import cached_bytes
+
+import main
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--local-dir", default=None)
+    args = parser.parse_args()
+    size = args.size_mb << 20
+    if not hasattr(os, "posix_fadvise"):
+        parser.exit(1, "os.posix_fadvise is not available on this platform\n")
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory(
+        dir=args.local_dir
+    ) as local:
+        os.mkdir(os.path.join(root, "MXF"))
+        with open(os.path.join(root, "MXF", "big.mxf"), "wb") as f:
+            f.write(os.urandom(size))
+        local_path = os.path.join(local, "big.mxf")
+
+        with ftp_server(root, "MXF"):
+            for drop_cache in (False, True):
+                configure(DROP_CACHE=drop_cache)
+                ftp = main.connect_ftp()
+                start = time.perf_counter()
+                main.retrieve_file(ftp, "big.mxf", local_path, 0, lambda size: None)
+                elapsed = time.perf_counter() - start
+                ftp.quit()
+                assert os.path.getsize(local_path) == size
+                print(
+                    f"DROP_CACHE={drop_cache!s:5}: {elapsed:.2f}s, "
+                    f"{cached_bytes(local_path) >> 20} of {args.size_mb} MiB cached"
+                )
+                os.remove(local_path)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,96 @@
+"""Downloads several files at once with PREALLOCATE off and on, and reports
+the blocks reserved for each file before its first write and the extents
+it ends up in (filefrag, when installed).
+
+Concurrent downloads interleave their allocations, which is where
+reserving the whole file up front shows in the extent count.
+
+    python bench/bench_preallocate.py [--size-mb 64] [--files 4]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from ftp_server import configure, ftp_server
+
+import main
+
+
+def extents(path: str) -> int | None:
+    if not shutil.which("filefrag"):
+        return None
+    output = subprocess.run(
+        ["filefrag", path], capture_output=True, text=True, check=True
+    ).stdout
+    return int(re.search(r"(\d+) extents? found", output).group(1))
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--local-dir", default=None)
+    args = parser.parse_args()
+    size = args.size_mb << 20
+    names = [f"f{i}.mxf" for i in range(args.files)]
+
+    # Blocks allocated to each file when its first block is written
+    reserved = {}
+    write = main.ResumeFile.write
+
+    def recording_write(resume, *blocks):
+        if resume.local_path not in reserved:
+            reserved[resume.local_path] = os.stat(resume.local_path).st_blocks * 512
+        return write(resume, *blocks)
+
+    main.ResumeFile.write = recording_write
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory(
+        dir=args.local_dir
+    ) as local:
+        os.mkdir(os.path.join(root, "MXF"))
+        for name in names:
+            with open(os.path.join(root, "MXF", name), "wb") as f:
+                f.write(os.urandom(size))
+
+        def download(name: str):
+            ftp = main.connect_ftp()
+            main.retrieve_file(
+                ftp, name, os.path.join(local, name), 0, lambda size: None, size
+            )
+            ftp.quit()
+
+        with ftp_server(root, "MXF"):
+            for preallocate in (False, True):
+                configure(PREALLOCATE=preallocate)
+                reserved.clear()
+                threads = [
+                    threading.Thread(target=download, args=(name,)) for name in names
+                ]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                paths = [os.path.join(local, name) for name in names]
+                assert all(os.path.getsize(path) == size for path in paths)
+                counts = [extents(path) for path in paths]
+                print(
+                    f"PREALLOCATE={preallocate!s:5}: {elapsed:.2f}s, reserved before "
+                    f"first write {min(reserved.values()) >> 20}-"
+                    f"{max(reserved.values()) >> 20} of {args.size_mb} MiB, "
+                    f"extents {counts if None not in counts else 'n/a'}"
+                )
+                for path in paths:
+                    os.remove(path)
+
+
+if __name__ == "__main__":
+    run()
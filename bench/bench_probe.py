@@ -0,0 +1,51 @@
+"""Times SIZE probing of a flat folder for a range of PROBE_CONNECTIONS.
+
+The server has MLSD and LIST disabled, so every file size needs its own
+SIZE round trip. The control connection runs through a latency proxy.
+
+    python bench/bench_probe.py [--files 2000] [--latency-ms 5]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+
+import main
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--connections", default="1,2,4,8")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, "MXF"))
+        for i in range(args.files):
+            with open(os.path.join(root, "MXF", f"f{i:05d}.mxf"), "wb") as f:
+                f.write(b"x" * (i % 97))
+
+        with ftp_server(
+            root, "MXF", args.latency_ms, disabled=("MLSD", "MLST", "LIST")
+        ):
+            ftp = main.connect_ftp()
+            names = ftp.nlst()
+            for connections in map(int, args.connections.split(",")):
+                configure(PROBE_CONNECTIONS=connections)
+                start = time.perf_counter()
+                entries = main.probe_remote_metadata(ftp, names)
+                elapsed = time.perf_counter() - start
+                assert all(entry.size is not None for entry in entries.values())
+                print(
+                    f"PROBE_CONNECTIONS={connections}: {elapsed:.2f}s "
+                    f"for {len(entries)} files"
+                )
+            ftp.quit()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,66 @@
+"""Measures the CPU time of one download with the default receive path,
+RECV_BLOCK_SIZE buffers and ZERO_COPY (splice).
+
+CPU time is that of the downloading thread only (time.thread_time, user
+plus system), since the server runs in the same process.
+
+    python bench/bench_splice.py [--size-mb 512] [--repeat 2]
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+
+import main
+
+MODES = {
+    "retrbinary": {},
+    "RECV_BLOCK_SIZE=1 MiB": {"RECV_BLOCK_SIZE": 1024 * 1024},
+    "ZERO_COPY": {"ZERO_COPY": True},
+}
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+    if not main.splice_supported:
+        parser.exit(1, "os.splice is not available on this platform\n")
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as local:
+        os.mkdir(os.path.join(root, "MXF"))
+        remote_path = os.path.join(root, "MXF", "big.mxf")
+        with open(remote_path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = file_digest(remote_path)
+        local_path = os.path.join(local, "big.mxf")
+
+        with ftp_server(root, "MXF"):
+            for _ in range(args.repeat):
+                for label, settings in MODES.items():
+                    configure(**settings)
+                    ftp = main.connect_ftp()
+                    start, start_cpu = time.perf_counter(), time.thread_time()
+                    main.retrieve_file(ftp, "big.mxf", local_path, 0, lambda size: None)
+                    cpu = time.thread_time() - start_cpu
+                    elapsed = time.perf_counter() - start
+                    ftp.quit()
+                    assert main.splice_supported or not settings.get("ZERO_COPY")
+                    assert file_digest(local_path) == expected
+                    os.remove(local_path)
+                    print(f"{label:<22}: {cpu:.2f}s CPU, {elapsed:.2f}s wall")
+
+
+if __name__ == "__main__":
+    run()
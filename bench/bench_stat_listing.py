@@ -0,0 +1,52 @@
+"""Times listing a folder with STAT over the control connection against
+MLSD over a data connection, for several folder sizes.
+
+    python bench/bench_stat_listing.py [--latency-ms 5] [--repeat 10]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+
+import main
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sizes", default="10,100,1000")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as root:
+        for size in sizes:
+            os.mkdir(os.path.join(root, f"d{size}"))
+            for i in range(size):
+                with open(os.path.join(root, f"d{size}", f"f{i:05d}.mxf"), "wb") as f:
+                    f.write(b"x" * i)
+
+        with ftp_server(root, "", args.latency_ms):
+            ftp = main.connect_ftp()
+            for size in sizes:
+                for stat in (False, True):
+                    configure(STAT_LISTING=stat)
+                    main.stat_listing_supported = None
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        entries = list(main.iter_remote_listing(ftp, f"d{size}"))
+                    elapsed = (time.perf_counter() - start) / args.repeat
+                    assert len(entries) == size
+                    assert main.stat_listing_supported is not False
+                    print(
+                        f"{size:5d} entries, STAT_LISTING={stat!s:5}: "
+                        f"{elapsed * 1000:.1f} ms/listing"
+                    )
+            ftp.quit()
+
+
+if __name__ == "__main__":
+    run()
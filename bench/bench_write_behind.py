@@ -0,0 +1,91 @@
+"""Times one download to a throttled disk for several WRITE_BEHIND_BUFFERS.
+
+The server sends at --net bytes/s. Local writes are slowed to --disk
+bytes/s, plus a --stall second pause every --stall-every-mb MiB like a
+writeback flush, by wrapping the files main opens for transfers. Stalls
+short enough for the socket receive buffer to absorb gain nothing from
+write-behind, nor does a disk that is slower than the network on average;
+the defaults are a fast disk with long stalls.
+
+    python bench/bench_write_behind.py [--size-mb 100] [--stall 1.0]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ftp_server import configure, ftp_server
+
+import main
+
+
+class ThrottledFile:
+    """A file whose writes take len / rate seconds, with periodic stalls."""
+
+    def __init__(self, local_file, rate: float, stall: float, stall_every: int):
+        self.local_file = local_file
+        self.rate = rate
+        self.stall = stall
+        self.stall_every = stall_every
+        self.since_stall = 0
+        self.debt = 0.0
+
+    def write(self, block):
+        self.debt += len(block) / self.rate
+        self.since_stall += len(block)
+        if self.since_stall >= self.stall_every:
+            self.since_stall = 0
+            self.debt += self.stall
+        # Sleep in slices of at least 5 ms, time.sleep is coarse below that
+        if self.debt > 0.005:
+            time.sleep(self.debt)
+            self.debt = 0.0
+        return self.local_file.write(block)
+
+    def fileno(self):
+        return self.local_file.fileno()
+
+    def close(self):
+        self.local_file.close()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--net", type=float, default=20e6)
+    parser.add_argument("--disk", type=float, default=200e6)
+    parser.add_argument("--stall", type=float, default=1.0)
+    parser.add_argument("--stall-every-mb", type=int, default=32)
+    parser.add_argument("--buffers", default="0,64,1024,4096")
+    args = parser.parse_args()
+    size = args.size_mb * 1000 * 1000
+
+    open_transfer_file = main.open_transfer_file
+    main.open_transfer_file = lambda *a: ThrottledFile(
+        open_transfer_file(*a), args.disk, args.stall, args.stall_every_mb << 20
+    )
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as local:
+        os.mkdir(os.path.join(root, "MXF"))
+        with open(os.path.join(root, "MXF", "big.mxf"), "wb") as f:
+            f.write(os.urandom(size))
+        local_path = os.path.join(local, "big.mxf")
+
+        with ftp_server(root, "MXF", rate=int(args.net)):
+            for buffers in map(int, args.buffers.split(",")):
+                configure(WRITE_BEHIND_BUFFERS=buffers)
+                ftp = main.connect_ftp()
+                start = time.perf_counter()
+                main.retrieve_file(ftp, "big.mxf", local_path, 0, lambda size: None)
+                elapsed = time.perf_counter() - start
+                ftp.quit()
+                assert os.path.getsize(local_path) == size
+                print(
+                    f"WRITE_BEHIND_BUFFERS={buffers:5d}: {elapsed:.2f}s "
+                    f"{size / elapsed / 1e6:.1f} MB/s"
+                )
+
+
+if __name__ == "__main__":
+    run()
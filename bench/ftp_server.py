@@ -0,0 +1,88 @@
+"""Local FTP server for the benchmarks.
+
+Serves a directory with pyftpdlib from a background thread, optionally
+behind a TCP proxy that delays every chunk by a fixed one-way latency, so
+round-trip-bound code paths behave like they do against a remote server.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from tests import support  # noqa: E402
+from tests.support import configure  # noqa: E402,F401
+
+
+async def pump(reader, writer, delay: float):
+    """Copies reader to writer, releasing each chunk delay seconds after it arrived."""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    async def send():
+        while True:
+            arrived, data = await chunks.get()
+            if not data:
+                writer.close()
+                return
+            await asyncio.sleep(arrived + delay - loop.time())
+            writer.write(data)
+            await writer.drain()
+
+    sender = asyncio.create_task(send())
+    while True:
+        data = await reader.read(65536)
+        await chunks.put((loop.time(), data))
+        if not data:
+            break
+    await sender
+
+
+def start_delay_proxy(target_port: int, delay: float) -> int:
+    """Runs a latency proxy to target_port on a daemon thread, returns its port."""
+    ready = threading.Event()
+    ports = []
+
+    async def serve():
+        async def relay(client_reader, client_writer):
+            server_reader, server_writer = await asyncio.open_connection(
+                "127.0.0.1", target_port
+            )
+            await asyncio.gather(
+                pump(client_reader, server_writer, delay),
+                pump(server_reader, client_writer, delay),
+                return_exceptions=True,
+            )
+
+        server = await asyncio.start_server(relay, "127.0.0.1", 0)
+        ports.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        await server.serve_forever()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    ready.wait()
+    return ports[0]
+
+
+@contextmanager
+def ftp_server(
+    root: str,
+    remote_dir: str,
+    latency_ms: float = 0,
+    disabled: tuple[str, ...] = (),
+    rate: int = 0,
+):
+    """Like tests.support.ftp_server, with latency_ms of one-way delay on
+    the control connection.
+
+    Data connections are not delayed: like ftplib, main connects them to
+    the port from the PASV reply on FTP_HOST, which is the server itself.
+    """
+    with support.ftp_server(root, remote_dir, disabled, rate) as server:
+        if latency_ms:
+            main.FTP_PORT = start_delay_proxy(main.FTP_PORT, latency_ms / 1000)
+        yield server
@@ -0,0 +1,47 @@
+"""Page cache residency of a file, with mincore(2) (Linux)."""
+
+import ctypes
+import ctypes.util
+import mmap
+import os
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+libc.mmap.restype = ctypes.c_void_p
+libc.mmap.argtypes = [
+    ctypes.c_void_p,
+    ctypes.c_size_t,
+    ctypes.c_int,
+    ctypes.c_int,
+    ctypes.c_int,
+    ctypes.c_long,
+]
+libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+def libc_error() -> OSError:
+    errno = ctypes.get_errno()
+    return OSError(errno, os.strerror(errno))
+
+
+def cached_bytes(path: str) -> int:
+    """Returns how many bytes of path are in the page cache."""
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vector = ctypes.create_string_buffer(pages)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if address == MAP_FAILED:
+            raise libc_error()
+        try:
+            if libc.mincore(address, size, vector) != 0:
+                raise libc_error()
+        finally:
+            libc.munmap(address, size)
+    finally:
+        os.close(fd)
+    return sum(byte & 1 for byte in vector.raw[:pages]) * mmap.PAGESIZE
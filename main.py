@@ -6,135 +6,1475 @@ import sys
 import json
 import time
 import sqlite3
+import hashlib
+import queue
+import functools
+import mmap
+import socket
+import asyncio
+import ctypes
+import struct
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+from errno import ENOSPC
+from typing import Iterable, Iterator, NamedTuple
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+# Settings config.json may leave out, with their defaults
+CONFIG_DEFAULTS = {
+    "INTERVAL_TIME": 120,
+    "PROBE_CONNECTIONS": 1,
+    "PIPELINE_WINDOW": 0,
+    "RECONCILE_MODE": "python",
+    "INCREMENTAL_SCAN": False,
+    "SKIP_UNCHANGED_SCANS": False,
+    "STAT_LISTING": False,
+    "RECURSIVE": False,
+    "WALK_CONNECTIONS": 4,
+    "DIR_CACHE_MAX_AGE": 0,
+    "ADAPTIVE_POLLING": False,
+    "POLL_MIN_INTERVAL": 30,
+    "POLL_MAX_INTERVAL": 86400,
+    "LOCAL_WATCH": False,
+    "VERIFY_LOCAL_MTIME": False,
+    "RESUME_OVERLAP": 65536,
+    "DOWNLOAD_CONNECTIONS": 1,
+    "SEGMENT_CONNECTIONS": 1,
+    "SEGMENT_SIZE": 268435456,
+    "ENGINE": "threads",
+    "WRITE_BEHIND_BUFFERS": 0,
+    "RECV_BLOCK_SIZE": 0,
+    "ZERO_COPY": False,
+    "PREALLOCATE": False,
+    "DROP_CACHE": False,
+    "DIRECT_IO": False,
+}
+
 
 # Enum class
 # 0 = Not downloaded (in remote not in local or incompleted file in local),
 # 1 = Downloaded (in local and remote),
-# 2 = Deleted (in local but not in remote)
+# 2 = Updated (changed in remote, download again)
+# 3 = Deleted (in local but not in remote)
+# 4 = Partial (transfer interrupted, resume its staged file)
 class VideoStatus:
     NOT_DOWNLOADED = 0
     DOWNLOADED = 1
     UPDATED = 2
     DELETED = 3
+    PARTIAL = 4
+
+
+class RemoteEntry(NamedTuple):
+    name: str
+    size: int | None
+    # YYYYMMDDHHMMSS from MLSD/MDTM, YYYYMMDDHHMM or YYYYMMDD from LIST/STAT
+    modify: str | None
+    type: str  # "file" or "dir"
+
+
+class LocalFile(NamedTuple):
+    size: int
+    mtime: int  # st_mtime_ns
+    inode: int
+
+
+LIST_MONTHS = {
+    month: index
+    for index, month in enumerate(
+        "jan feb mar apr may jun jul aug sep oct nov dec".split(), start=1
+    )
+}
+
+
+# Seconds to wait for each reply of a pipelined window before assuming the
+# server dropped the queued commands
+PIPELINE_REPLY_TIMEOUT = 10
 
+# None until the first pipelined window shows whether the server copes
+pipelining_tolerated: bool | None = None
 
-def scan_remote(ftp_client: ftplib.FTP, remote_dir: str):
+
+# False once the server answered STAT <dir> with something other than a listing
+stat_listing_supported: bool | None = None
+
+# FEAT result, checked once per run
+mlsd_supported: bool | None = None
+
+
+class PipelineError(Exception):
+    """The server did not answer a pipelined window in order."""
+
+
+def connect_ftp(ftp_client: ftplib.FTP | None = None) -> ftplib.FTP:
+    """Opens a logged-in connection with REMOTE_DIR as working directory.
+
+    Passing an existing (closed) client reconnects it in place.
+    """
+    if ftp_client is None:
+        ftp_client = ftplib.FTP()
     try:
-        remote_files = ftp_client.nlst()
-        local_files = get_local_files()
+        ftp_client.connect(FTP_HOST, FTP_PORT)
+        ftp_client.login(FTP_USER, FTP_PASSWORD)
+        ftp_client.cwd(REMOTE_DIR)
+        ftp_client.set_pasv(True)
+    except ftplib.all_errors:
+        ftp_client.close()
+        raise
+    return ftp_client
 
-        cur.execute(
-            "SELECT * FROM videos ORDER BY video_id ASC",
-        )
-        rows: list[sqlite3.Row] = cur.fetchall()
-        for row in rows:
-            if row["video_id"] not in remote_files:
-                if (
-                    row["video_status"] == VideoStatus.DOWNLOADED
-                    or row["video_status"] == VideoStatus.UPDATED
-                ):
-                    cur.execute(
-                        "UPDATE videos SET video_status = ? WHERE video_id = ?",
-                        (VideoStatus.DELETED, row["video_id"]),
-                    )
-                elif (row["video_status"] == VideoStatus.NOT_DOWNLOADED) or (
-                    row["video_status"] == VideoStatus.DELETED
-                    and row["video_id"] not in local_files
-                ):
-                    cur.execute(
-                        "DELETE FROM videos where video_id = ?", (row["video_id"],)
-                    )
-                elif (row["video_status"] == VideoStatus.DELETED) and (
-                    row["video_id"] in local_files
-                ):
-                    cur.execute(
-                        "UPDATE videos SET video_status = ? WHERE video_id = ?",
-                        (VideoStatus.UPDATED, row["video_id"]),
-                    )
-            elif row["video_id"] in local_files:  # and in remote
-                if (
-                    row["video_status"] == VideoStatus.DELETED
-                    or row["video_status"] == VideoStatus.NOT_DOWNLOADED
-                ):
-                    cur.execute(
-                        "UPDATE videos SET video_status = ? WHERE video_id = ?",
-                        (VideoStatus.UPDATED, row["video_id"]),
-                    )
-            elif row["video_id"] not in local_files:  # and in remote
-                if row["video_status"] == VideoStatus.DELETED:
-                    cur.execute(
-                        "DELETE FROM videos where video_id = ?", (row["video_id"],)
-                    )
 
-        conn.commit()
+class FTPPool:
+    """Logged-in FTP connections shared by worker threads.
+
+    Connections are opened lazily, so the pool never holds more of them than
+    there were concurrent borrowers. A connection that raised an FTP error is
+    closed instead of being returned to the pool.
+    """
 
-        for remote_file in remote_files:
+    def __init__(self):
+        self._idle: queue.Queue[ftplib.FTP] = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def connection(self):
+        try:
+            ftp_client = self._idle.get_nowait()
+        except queue.Empty:
+            ftp_client = connect_ftp()
+        try:
+            yield ftp_client
+        except ftplib.all_errors:
+            ftp_client.close()
+            raise
+        self._idle.put(ftp_client)
+
+    def close(self):
+        while True:
             try:
-                ftp_client.voidcmd("TYPE I")
-                remote_file_size = ftp_client.size(remote_file)
-            except ftplib.error_perm:
-                # File being modified, cannot get size
+                ftp_client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                ftp_client.quit()
+            except ftplib.all_errors:
+                ftp_client.close()
+
+
+def server_supports_mlsd(ftp_client: ftplib.FTP) -> bool:
+    """Checks the FEAT reply for MLST, which also covers MLSD (RFC 3659)."""
+    try:
+        features = ftp_client.sendcmd("FEAT")
+    except ftplib.error_perm:
+        return False
+    return features_include_mlst(features)
+
+
+def features_include_mlst(features: str) -> bool:
+    for line in features.splitlines()[1:]:
+        if line.strip().upper().startswith("MLST"):
+            return True
+    return False
+
+
+def parse_mlsd_line(line: str) -> RemoteEntry | None:
+    """Parses one MLSD line: 'type=file;size=1024;modify=20240101120000; name'."""
+    facts_part, sep, name = line.partition(" ")
+    if not sep or not name:
+        return None
+    facts = {}
+    for fact in facts_part.rstrip(";").split(";"):
+        key, _, value = fact.partition("=")
+        facts[key.lower()] = value
+    entry_type = facts.get("type", "").lower()
+    if entry_type not in ("file", "dir"):
+        # cdir, pdir, links and OS specific types are not mirrored
+        return None
+    size = facts.get("size")
+    modify = facts.get("modify")
+    return RemoteEntry(
+        name,
+        int(size) if size and size.isdigit() else None,
+        modify[:14] if modify else None,
+        entry_type,
+    )
+
+
+def is_dot_line(line: str) -> bool:
+    """Whether a LIST line is the "." or ".." entry, which STAT and LIST -a
+    include. They say nothing about the line format."""
+    return line.endswith((" .", " .."))
+
+
+def parse_list_line(line: str) -> RemoteEntry | None:
+    """Parses one LIST line in Unix (ls -l) or DOS (IIS) format."""
+    parts = line.split(None, 8)
+    if len(parts) == 9 and parts[0][0] in "-d":
+        # -rw-r--r-- 1 owner group 1024 Jan 01 12:00 name
+        mode, _, _, _, size, month, day, year_or_time, name = parts
+        if name in (".", ".."):
+            # STAT and LIST -a include them
+            return None
+        month_number = LIST_MONTHS.get(month[:3].lower())
+        if month_number is None or not size.isdigit() or not day.isdigit():
+            return None
+        now = datetime.now()
+        try:
+            if ":" in year_or_time:
+                hour, _, minute = year_or_time.partition(":")
+                modified = datetime(
+                    now.year, month_number, int(day), int(hour), int(minute)
+                )
+                if modified > now:
+                    # Without a year, ls shows the last 6 months
+                    modified = modified.replace(year=now.year - 1)
+                # The year is a guess, see same_mtime
+                modify = modified.strftime("%Y%m%d%H%M")
+            elif mode[0] == "d":
+                # Enough to tell a directory changed, which shows a time again
+                modified = datetime(int(year_or_time), month_number, int(day))
+                modify = modified.strftime("%Y%m%d")
+            else:
+                # Older than 6 months, the date alone is too coarse to compare
+                modify = None
+        except ValueError:
+            # Feb 29 outside a leap year, a garbled day or time
+            return None
+        return RemoteEntry(name, int(size), modify, "dir" if mode[0] == "d" else "file")
+
+    parts = line.split(None, 3)
+    if len(parts) == 4:
+        # 01-15-24  03:45PM       <DIR>          name
+        # 01-15-24  03:45PM            1024 name
+        date, clock, size, name = parts
+        if name in (".", ".."):
+            return None
+        try:
+            modified = datetime.strptime(f"{date} {clock}", "%m-%d-%y %I:%M%p")
+        except ValueError:
+            return None
+        if size.upper() == "<DIR>":
+            return RemoteEntry(name, None, modified.strftime("%Y%m%d%H%M"), "dir")
+        if size.isdigit():
+            return RemoteEntry(name, int(size), modified.strftime("%Y%m%d%H%M"), "file")
+    return None
+
+
+def comparable_mtimes(a: str | None, b: str | None) -> bool:
+    """Two modify times can be compared when both are known and have the
+    same precision, i.e. came from the same kind of listing."""
+    return a is not None and b is not None and len(a) == len(b)
+
+
+def same_mtime(a: str, b: str) -> bool:
+    """Compares comparable modify times.
+
+    Minute precision times come from LIST, whose year the client guessed
+    from its own clock, so only month to minute are compared.
+    """
+    if len(a) == 12:
+        return a[4:] == b[4:]
+    return a == b
+
+
+def iter_lines(ftp_client: ftplib.FTP, command: str) -> Iterator[str]:
+    """Yields the lines of a listing command as they arrive, like retrlines.
+
+    Other commands can only be sent on ftp_client once the generator is
+    exhausted or closed. Closing it early drops the data connection and
+    reads the transfer reply, so the control channel stays in sync.
+    """
+    ftp_client.sendcmd("TYPE A")
+    closed_early = False
+    with ftp_client.transfercmd(command) as data_conn:
+        with data_conn.makefile("r", encoding=ftp_client.encoding) as data_file:
+            try:
+                for line in data_file:
+                    yield line.rstrip("\r\n")
+            except GeneratorExit:
+                closed_early = True
+    if closed_early:
+        # 426 for the aborted transfer, or 226 if it had already completed
+        try:
+            ftp_client.getresp()
+        except (ftplib.error_temp, ftplib.error_perm):
+            pass
+        return
+    ftp_client.voidresp()
+
+
+def stat_listing(ftp_client: ftplib.FTP, path: str = "") -> list[RemoteEntry] | None:
+    """Lists a directory with STAT over the control connection.
+
+    This saves the PASV round trip and the data connection handshake. The
+    multiline reply is parsed like LIST output and held in memory, so it
+    suits small and medium directories. Returns None when the server does
+    not answer STAT <dir> with a LIST style listing. Other error replies,
+    such as 450 or 550 for this directory, are raised.
+    """
+    try:
+        reply = ftp_client.sendcmd(f"STAT {path or '.'}")
+    except ftplib.error_perm as e:
+        if str(e)[:3] in ("500", "501", "502", "504"):
+            return None
+        raise
+    code = reply[:3]
+    if code not in ("211", "212", "213"):
+        return None
+    entries = []
+    known_format = None
+    # First and last lines are the "213-Status of ..." and "213 End" framing
+    for line in reply.splitlines()[1:-1]:
+        if line.startswith(f"{code}-"):
+            line = line[4:]
+        elif line.startswith(" "):
+            line = line[1:]
+        if not line.strip() or line.lower().startswith("total ") or is_dot_line(line):
+            continue
+        entry = parse_list_line(line)
+        if known_format is None:
+            known_format = entry is not None
+            if not known_format:
+                return None
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def iter_remote_listing(
+    ftp_client: ftplib.FTP, path: str = ""
+) -> Iterator[RemoteEntry]:
+    """Streams a remote directory with names, sizes and mtimes.
+
+    path is relative to the working directory, which is listed by default.
+    With STAT_LISTING the listing is first requested over the control
+    connection. Otherwise, or when the server does not support that, MLSD
+    is used when the server advertises it, so the whole listing arrives in
+    one data transfer. Otherwise LIST output is parsed. When the first LIST
+    line is in an unknown format, NLST gives names only (size and modify are
+    None). Entries are yielded one by one, so memory does not grow with the
+    directory size.
+    """
+    global stat_listing_supported, mlsd_supported
+    if STAT_LISTING and stat_listing_supported is not False:
+        try:
+            entries = stat_listing(ftp_client, path)
+        except (ftplib.error_perm, ftplib.error_temp):
+            # About this directory, not STAT; the data listing reports it
+            entries = None
+        else:
+            stat_listing_supported = entries is not None
+        if entries is not None:
+            yield from entries
+            return
+
+    if mlsd_supported is None:
+        mlsd_supported = server_supports_mlsd(ftp_client)
+    if mlsd_supported:
+        for line in iter_lines(ftp_client, f"MLSD {path}".rstrip()):
+            entry = parse_mlsd_line(line)
+            if entry is not None:
+                yield entry
+        return
+
+    known_format = None
+    try:
+        for line in iter_lines(ftp_client, f"LIST {path}".rstrip()):
+            if (
+                not line.strip()
+                or line.lower().startswith("total ")
+                or is_dot_line(line)
+            ):
                 continue
-            cur.execute("SELECT * FROM videos WHERE video_id = ?", (remote_file,))
-            row: sqlite3.Row = cur.fetchone()
-            if row is None:
-                cur.execute(
-                    "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES (?, ?, ?)",
-                    (remote_file, VideoStatus.NOT_DOWNLOADED, remote_file_size),
+            entry = parse_list_line(line)
+            if known_format is None:
+                known_format = entry is not None
+            if known_format and entry is not None:
+                yield entry
+    except ftplib.error_perm:
+        known_format = False
+    if known_format is not False:
+        return
+
+    # Unknown LIST format, names only
+    for line in iter_lines(ftp_client, f"NLST {path}".rstrip()):
+        name = line.rsplit("/", 1)[-1]
+        if name not in ("", ".", ".."):
+            yield RemoteEntry(name, None, None, "file")
+
+
+def remote_path_join(directory: str, name: str) -> str:
+    return f"{directory}/{name}" if directory else name
+
+
+def digest_entry(digest, entry: RemoteEntry):
+    """Feeds one listing entry into a running hash."""
+    digest.update(f"{entry.type}/{entry.name}/{entry.size}/{entry.modify}\n".encode())
+
+
+def dir_cache_enabled() -> bool:
+    return DIR_CACHE_MAX_AGE > 0 or ADAPTIVE_POLLING
+
+
+def load_dir_cache() -> dict[str, sqlite3.Row]:
+    """Loads the per-directory listing cache, empty when it is disabled."""
+    if not dir_cache_enabled():
+        return {}
+    return {
+        row["dir_path"]: row
+        for row in conn.execute(
+            "SELECT dir_path, dir_modify, entry_digest, listed_at, poll_interval, "
+            "next_poll FROM remote_dirs"
+        )
+    }
+
+
+def directory_unchanged(
+    cached: sqlite3.Row | None, modify: str | None, now: float
+) -> bool:
+    """A directory can be skipped when its parent reports the same modify
+    time as when it was last listed, and that listing is not too old.
+
+    With ADAPTIVE_POLLING the age limit is the directory's own poll
+    interval, and a directory whose parent was not listed is trusted until
+    it is due.
+    """
+    if cached is None:
+        return False
+    if modify is not None and modify != cached["dir_modify"]:
+        return False
+    if ADAPTIVE_POLLING:
+        return cached["next_poll"] is not None and now < cached["next_poll"]
+    return modify is not None and now - cached["listed_at"] < DIR_CACHE_MAX_AGE
+
+
+def next_poll_interval(cached: sqlite3.Row | None, entry_digest: str) -> float:
+    """Learns how often a directory changes from its listing history.
+
+    The interval halves each time a listing differs from the previous one
+    and doubles each time it does not, within POLL_MIN_INTERVAL and
+    POLL_MAX_INTERVAL. New directories start at the minimum.
+    """
+    if cached is None or cached["poll_interval"] is None:
+        return POLL_MIN_INTERVAL
+    if entry_digest != cached["entry_digest"]:
+        interval = cached["poll_interval"] / 2
+    else:
+        interval = cached["poll_interval"] * 2
+    return min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+
+def next_cycle_delay(completed: bool = True) -> float:
+    """Seconds to sleep before the next cycle.
+
+    With ADAPTIVE_POLLING in a recursive scan, the loop wakes up when the
+    first directory is due instead of every INTERVAL_TIME. It still wakes up
+    after INTERVAL_TIME at most when the last cycle did not complete or rows
+    are waiting for a download, resume or delete, so they are retried as
+    often as without it.
+    """
+    if not (ADAPTIVE_POLLING and RECURSIVE):
+        return INTERVAL_TIME
+    (next_poll,) = conn.execute("SELECT MIN(next_poll) FROM remote_dirs").fetchone()
+    if next_poll is None:
+        return POLL_MIN_INTERVAL
+    delay = min(max(next_poll - time.time(), POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+    if not completed or catalog_pending():
+        delay = min(delay, INTERVAL_TIME)
+    return delay
+
+
+def cached_directory_entries(
+    directory: str, dir_cache: dict[str, sqlite3.Row]
+) -> Iterator[RemoteEntry]:
+    """Rebuilds the listing of an unchanged directory from the database.
+
+    Files come from the catalog: every row inside the directory except
+    DELETED ones, which were already missing from its last listing.
+    Subdirectories come from the directory cache with their cached modify
+    time. Names are relative to the directory, as in a real listing.
+    """
+    prefix = f"{directory}/"
+    # "0" sorts right after "/", so this range is exactly the prefix
+    for row in conn.execute(
+        "SELECT video_id, video_remote_size, video_remote_mtime FROM videos "
+        "WHERE video_id > ? AND video_id < ? AND video_status != ?",
+        (prefix, f"{directory}0", VideoStatus.DELETED),
+    ):
+        name = row["video_id"][len(prefix) :]
+        if "/" not in name:
+            yield RemoteEntry(
+                name, row["video_remote_size"], row["video_remote_mtime"], "file"
+            )
+    for dir_path, cached in dir_cache.items():
+        parent, _, name = dir_path.rpartition("/")
+        if parent == directory and name:
+            yield RemoteEntry(name, None, cached["dir_modify"], "dir")
+
+
+def walk_remote_tree(ftp_client: ftplib.FTP) -> Iterator[RemoteEntry]:
+    """Walks the tree under REMOTE_DIR breadth-first.
+
+    Yields files and directories named by their path relative to REMOTE_DIR
+    ("2024/01/clip.mxf"). With WALK_CONNECTIONS > 1 up to that many
+    directories are listed at once on pooled connections; otherwise
+    ftp_client lists them one after another.
+
+    With DIR_CACHE_MAX_AGE > 0, a subdirectory whose modify time in its
+    parent's listing is unchanged is not listed again until its cached
+    listing is DIR_CACHE_MAX_AGE seconds old; its entries are rebuilt from
+    the database instead, and its subdirectories are judged by their cached
+    modify times. Changes that do not touch the modify time of a directory
+    whose parent is listed (files rewritten in place, anything deeper down)
+    are picked up once the cached listing above them expires.
+    """
+    dir_cache = load_dir_cache()
+    scanned_at = time.time()
+    to_visit = deque([("", None)])  # (directory, modify reported by parent)
+    pending = set()
+    listed_rows = []
+    visited = set()
+
+    def expand(
+        directory: str, modify: str | None, entries: Iterable[RemoteEntry], listed: bool
+    ) -> Iterator[RemoteEntry]:
+        digest = hashlib.sha1()
+        for entry in entries:
+            if entry.name in ("", ".", "..") or "/" in entry.name:
+                # Would loop forever or name a path outside the directory
+                continue
+            digest_entry(digest, entry)
+            entry = entry._replace(name=remote_path_join(directory, entry.name))
+            if entry.type == "dir":
+                to_visit.append((entry.name, entry.modify))
+            yield entry
+        visited.add(directory)
+        if listed:
+            entry_digest = digest.hexdigest()
+            interval = next_poll_interval(dir_cache.get(directory), entry_digest)
+            listed_rows.append(
+                (
+                    directory,
+                    modify,
+                    entry_digest,
+                    scanned_at,
+                    interval,
+                    scanned_at + interval,
+                )
+            )
+
+    pool = FTPPool()
+
+    if ENGINE == "asyncio":
+
+        async def list_directory(client: AsyncFTP, directory: str, modify: str | None):
+            return directory, modify, await client.listing(directory)
+
+    else:
+
+        def list_directory(directory: str, modify: str | None):
+            with pool.connection() as worker_client:
+                return (
+                    directory,
+                    modify,
+                    list(iter_remote_listing(worker_client, directory)),
                 )
-            elif remote_file_size != row["video_remote_size"]:
+
+    with pool, transfer_executor(WALK_CONNECTIONS) as executor:
+        try:
+            while to_visit or pending:
+                while to_visit:
+                    directory, modify = to_visit.popleft()
+                    if directory_unchanged(
+                        dir_cache.get(directory), modify, scanned_at
+                    ):
+                        entries = cached_directory_entries(directory, dir_cache)
+                        yield from expand(directory, modify, entries, False)
+                    elif WALK_CONNECTIONS <= 1:
+                        entries = iter_remote_listing(ftp_client, directory)
+                        yield from expand(directory, modify, entries, True)
+                    else:
+                        pending.add(executor.submit(list_directory, directory, modify))
+                if pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from expand(*future.result(), True)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    if dir_cache_enabled():
+        conn.executemany(
+            "INSERT OR REPLACE INTO remote_dirs (dir_path, dir_modify, entry_digest, listed_at, poll_interval, next_poll) VALUES (?, ?, ?, ?, ?, ?)",
+            listed_rows,
+        )
+        conn.executemany(
+            "DELETE FROM remote_dirs WHERE dir_path = ?",
+            ((dir_path,) for dir_path in dir_cache if dir_path not in visited),
+        )
+
+
+def iter_remote_files(ftp_client: ftplib.FTP) -> Iterator[RemoteEntry]:
+    """Yields the remote entries to mirror, the whole tree with RECURSIVE."""
+    if RECURSIVE:
+        return walk_remote_tree(ftp_client)
+    return iter_remote_listing(ftp_client)
+
+
+# Probe command for each fact of a RemoteEntry
+PROBE_COMMANDS = {"size": "SIZE", "modify": "MDTM"}
+
+
+def parse_probe_reply(fact: str, reply: str) -> int | str | None:
+    """Extracts a fact from a SIZE/MDTM reply, None for error replies."""
+    if reply[:3] != "213":
+        return None
+    if fact == "size":
+        return int(reply[3:].strip())
+    return reply[4:18]
+
+
+def probe_file(
+    ftp_client: ftplib.FTP, name: str, facts: tuple[str, ...] = ("size",)
+) -> RemoteEntry:
+    """Gets the requested facts ("size", "modify") of one file with SIZE/MDTM.
+
+    Facts the server refuses, e.g. for a file being modified, are None.
+    """
+    values = dict.fromkeys(PROBE_COMMANDS)
+    for fact in facts:
+        try:
+            reply = ftp_client.sendcmd(f"{PROBE_COMMANDS[fact]} {name}")
+        except ftplib.error_perm:
+            continue
+        values[fact] = parse_probe_reply(fact, reply)
+    return RemoteEntry(name, values["size"], values["modify"], "file")
+
+
+def send_pipelined(ftp_client: ftplib.FTP, commands: list[str]) -> list[str]:
+    """Writes all commands to the control socket, then reads replies in order.
+
+    Error replies are returned as text like normal ones. Raises PipelineError
+    when a reply times out or is a syntax/sequence error (500-503), which is
+    how servers that drop or garble queued commands show up.
+    """
+    payload = "".join(f"{command}\r\n" for command in commands)
+    ftp_client.sock.sendall(payload.encode(ftp_client.encoding))
+    timeout = ftp_client.sock.gettimeout()
+    ftp_client.sock.settimeout(PIPELINE_REPLY_TIMEOUT)
+    replies = []
+    try:
+        for _ in commands:
+            try:
+                reply = ftp_client.getresp()
+            except (ftplib.error_perm, ftplib.error_temp) as e:
+                reply = str(e)
+            if reply[:3] in ("500", "501", "502", "503"):
+                raise PipelineError(reply)
+            replies.append(reply)
+    except TimeoutError:
+        raise PipelineError("Timed out waiting for pipelined reply")
+    finally:
+        ftp_client.sock.settimeout(timeout)
+    return replies
+
+
+def probe_files_pipelined(
+    ftp_client: ftplib.FTP,
+    names: list[str],
+    results: list[RemoteEntry],
+    facts: tuple[str, ...] = ("size",),
+):
+    """Probes names in windows of PIPELINE_WINDOW commands, appending to results."""
+    files_per_window = max(1, PIPELINE_WINDOW // len(facts))
+    for start in range(len(results), len(names), files_per_window):
+        window = names[start : start + files_per_window]
+        commands = [
+            f"{PROBE_COMMANDS[fact]} {name}" for name in window for fact in facts
+        ]
+        replies = iter(send_pipelined(ftp_client, commands))
+        for name in window:
+            values = dict.fromkeys(PROBE_COMMANDS)
+            for fact in facts:
+                values[fact] = parse_probe_reply(fact, next(replies))
+            results.append(RemoteEntry(name, values["size"], values["modify"], "file"))
+
+
+def probe_files(
+    ftp_client: ftplib.FTP, names: list[str], facts: tuple[str, ...] = ("size",)
+) -> list[RemoteEntry]:
+    """Probes names on one connection, pipelined when PIPELINE_WINDOW > 1.
+
+    A server that fails a pipelined window is remembered as intolerant; the
+    connection is reopened, since its reply stream can no longer be trusted,
+    and the remaining names are probed in lock-step.
+    """
+    global pipelining_tolerated
+    ftp_client.voidcmd("TYPE I")
+    results: list[RemoteEntry] = []
+    if PIPELINE_WINDOW > 1 and pipelining_tolerated is not False:
+        try:
+            probe_files_pipelined(ftp_client, names, results, facts)
+            pipelining_tolerated = True
+            return results
+        except PipelineError as e:
+            logging.warning(f"Pipelining disabled, server replied out of order: {e}")
+            pipelining_tolerated = False
+            ftp_client.close()
+            connect_ftp(ftp_client)
+            ftp_client.voidcmd("TYPE I")
+    for name in names[len(results) :]:
+        results.append(probe_file(ftp_client, name, facts))
+    return results
+
+
+def probe_remote_metadata(
+    ftp_client: ftplib.FTP, names: list[str], facts: tuple[str, ...] = ("size",)
+) -> dict[str, RemoteEntry]:
+    """Probes SIZE/MDTM for names the listing could not provide facts for.
+
+    With PROBE_CONNECTIONS > 1 the names are split across that many extra
+    logged-in connections, one worker thread each, so the round trips of
+    different files overlap. With ENGINE = "asyncio" each name is its own
+    task, run on that many connections of one event loop.
+    """
+    connections = min(PROBE_CONNECTIONS, len(names))
+    if connections <= 1:
+        return {entry.name: entry for entry in probe_files(ftp_client, names, facts)}
+
+    if ENGINE == "asyncio":
+        with AsyncEngine(connections) as engine:
+            futures = [engine.submit(AsyncFTP.probe, name, facts) for name in names]
+            return {entry.name: entry for entry in (f.result() for f in futures)}
+
+    pool = FTPPool()
+
+    def probe_chunk(chunk: list[str]) -> list[RemoteEntry]:
+        with pool.connection() as worker_client:
+            return probe_files(worker_client, chunk, facts)
+
+    results: dict[str, RemoteEntry] = {}
+    with pool, ThreadPoolExecutor(connections) as executor:
+        chunks = [names[i::connections] for i in range(connections)]
+        for entries in executor.map(probe_chunk, chunks):
+            for entry in entries:
+                results[entry.name] = entry
+    return results
+
+
+def complete_unsized(
+    ftp_client: ftplib.FTP, entries: list[RemoteEntry]
+) -> dict[str, RemoteEntry]:
+    """Fills in the sizes the listing did not provide.
+
+    In INCREMENTAL_SCAN mode a file whose modify time (from the listing, or
+    else from MDTM) matches the catalog keeps its catalog size, so SIZE is
+    only sent for new or changed files.
+    """
+    if not INCREMENTAL_SCAN:
+        return probe_remote_metadata(ftp_client, [entry.name for entry in entries])
+
+    dated = {entry.name: entry for entry in entries if entry.modify is not None}
+    undated = [entry.name for entry in entries if entry.modify is None]
+    if undated:
+        dated.update(probe_remote_metadata(ftp_client, undated, ("modify",)))
+
+    results: dict[str, RemoteEntry] = {}
+    changed = []
+    for name, entry in dated.items():
+        row = cur.execute(
+            "SELECT video_remote_size, video_remote_mtime FROM videos WHERE video_id = ?",
+            (name,),
+        ).fetchone()
+        if (
+            row is not None
+            and row["video_remote_size"] is not None
+            and comparable_mtimes(entry.modify, row["video_remote_mtime"])
+            and same_mtime(entry.modify, row["video_remote_mtime"])
+        ):
+            results[name] = entry._replace(size=row["video_remote_size"])
+        else:
+            changed.append(name)
+    if changed:
+        for name, entry in probe_remote_metadata(ftp_client, changed).items():
+            results[name] = entry._replace(modify=dated[name].modify)
+    return results
+
+
+# Columns added to the videos table after its first release, created on
+# existing databases at startup
+VIDEOS_EXTRA_COLUMNS = {
+    "last_seen_scan": "INTEGER NOT NULL DEFAULT 0",
+    "video_remote_mtime": "TEXT",
+    "video_local_mtime": "INTEGER",
+}
+
+REMOTE_DIRS_EXTRA_COLUMNS = {
+    "poll_interval": "REAL",
+    "next_poll": "REAL",
+}
+
+
+def add_missing_columns(table: str, extra_columns: dict[str, str]):
+    """Brings a table created by an older version up to date."""
+    columns = {row["name"] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for column, definition in extra_columns.items():
+        if column not in columns:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_tables():
+    """Creates the catalog tables, upgrading ones from older versions."""
+    create_table = """
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id STRING PRIMARY KEY,
+            video_status INTEGER,
+            video_remote_size INTEGER                
+        );
+    """
+    cur.execute(create_table)
+    add_missing_columns("videos", VIDEOS_EXTRA_COLUMNS)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS videos_status_scan ON videos (video_status, last_seen_scan)"
+    )
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS sync_state (name STRING PRIMARY KEY, value)"
+    )
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS remote_dirs (
+            dir_path TEXT PRIMARY KEY,
+            dir_modify TEXT,
+            entry_digest TEXT,
+            listed_at REAL
+        )
+        """)
+    add_missing_columns("remote_dirs", REMOTE_DIRS_EXTRA_COLUMNS)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS segments (
+            video_id TEXT,
+            segment_start INTEGER,
+            segment_end INTEGER,
+            done INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (video_id, segment_start)
+        )
+        """)
+    # Written by earlier versions but never read: the first snapshot of a
+    # run has to walk LOCAL_DIR anyway, since nothing watched it meanwhile
+    cur.execute("DROP TABLE IF EXISTS local_index")
+
+
+def next_scan_generation() -> int:
+    """Increments and returns the scan counter kept in sync_state."""
+    cur.execute(
+        "INSERT INTO sync_state (name, value) VALUES ('scan_generation', 1) "
+        "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+    )
+    return cur.execute(
+        "SELECT value FROM sync_state WHERE name = 'scan_generation'"
+    ).fetchone()[0]
+
+
+def get_sync_state(name: str):
+    row = cur.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return None if row is None else row["value"]
+
+
+def set_sync_state(name: str, value):
+    cur.execute(
+        "INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, value)
+    )
+    conn.commit()
+
+
+class ListingFingerprint:
+    """Summarizes a remote listing for change detection, from the entries
+    scan_remote lists anyway.
+
+    The fingerprint is the entry count, the newest modify time and the sum of
+    the SHA-1 of each entry, which does not depend on the order parallel
+    walkers list directories in. It is None when the listing has neither sizes
+    nor modify times (NLST fallback), since a file growing in place would
+    then go unnoticed.
+    """
+
+    def __init__(self):
+        self.digest_sum = 0
+        self.count = 0
+        self.newest = ""
+        self.names_only = False
+
+    def add(self, entry: RemoteEntry):
+        if entry.size is None and entry.modify is None and entry.type == "file":
+            self.names_only = True
+        self.count += 1
+        self.newest = max(self.newest, entry.modify or "")
+        digest = hashlib.sha1()
+        digest_entry(digest, entry)
+        self.digest_sum += int.from_bytes(digest.digest(), "big")
+
+    def value(self) -> str | None:
+        if self.names_only:
+            return None
+        return f"{self.count}:{self.newest}:{self.digest_sum % (1 << 160):040x}"
+
+
+def remote_unchanged(fingerprint: str | None) -> bool:
+    """Checks the fingerprint against the last completed cycle.
+
+    Also requires that no catalog row is waiting for a download, resume or
+    delete.
+    """
+    if fingerprint is None or fingerprint != get_sync_state("remote_fingerprint"):
+        return False
+    return not catalog_pending()
+
+
+def catalog_pending() -> bool:
+    """Whether a catalog row is waiting for a download, resume or delete."""
+    pending = cur.execute(
+        "SELECT 1 FROM videos WHERE video_status IN (?, ?, ?, ?) LIMIT 1",
+        (
+            VideoStatus.NOT_DOWNLOADED,
+            VideoStatus.UPDATED,
+            VideoStatus.DELETED,
+            VideoStatus.PARTIAL,
+        ),
+    ).fetchone()
+    return pending is not None
+
+
+# Target status meaning "remove the catalog row"
+DROP_ROW = -1
+
+# (status, in remote, in local) -> new status. Combinations that are not
+# listed keep their current status.
+RECONCILE_TRANSITIONS = {
+    (VideoStatus.DOWNLOADED, False, False): VideoStatus.DELETED,
+    (VideoStatus.DOWNLOADED, False, True): VideoStatus.DELETED,
+    (VideoStatus.UPDATED, False, False): VideoStatus.DELETED,
+    (VideoStatus.UPDATED, False, True): VideoStatus.DELETED,
+    (VideoStatus.NOT_DOWNLOADED, False, False): DROP_ROW,
+    (VideoStatus.NOT_DOWNLOADED, False, True): DROP_ROW,
+    (VideoStatus.DELETED, False, False): DROP_ROW,
+    (VideoStatus.DELETED, False, True): VideoStatus.UPDATED,
+    (VideoStatus.NOT_DOWNLOADED, True, True): VideoStatus.UPDATED,
+    (VideoStatus.DELETED, True, True): VideoStatus.UPDATED,
+    (VideoStatus.DELETED, True, False): DROP_ROW,
+    (VideoStatus.PARTIAL, False, False): VideoStatus.DELETED,
+    (VideoStatus.PARTIAL, False, True): VideoStatus.DELETED,
+}
+
+
+class Transitions(NamedTuple):
+    """Catalog changes, shaped as executemany parameters."""
+
+    deletes: list[tuple[str]]  # (video_id,)
+    status_updates: list[tuple[int, str]]  # (video_status, video_id)
+    inserts: list[tuple[str, int, int, str | None]]  # (video_id, status, size, mtime)
+    changes: list[tuple[int, int, str | None, str]]  # (status, size, mtime, video_id)
+    mtime_updates: list[tuple[str, str]]  # (mtime, video_id)
+
+
+def diff_catalog(
+    remote_files: dict[str, RemoteEntry],
+    local_files: dict[str, LocalFile],
+    catalog: dict[str, tuple[int, int | None, str | None]],
+) -> Transitions:
+    """Computes the catalog transitions for one scan, without touching the DB.
+
+    catalog maps video_id to (video_status, video_remote_size,
+    video_remote_mtime). Remote files without a known size are treated as
+    present but are not inserted or changed, since they are probably still
+    being written. A file is UPDATED when its size changes, or its modify
+    time does while both the listing and the catalog know it at the same
+    precision. A modify time of another precision, after the listing
+    source changed, replaces the catalog's without marking the file.
+    """
+    transitions = Transitions([], [], [], [], [])
+    dropped = set()
+    for video_id, (status, _, _) in catalog.items():
+        key = (status, video_id in remote_files, video_id in local_files)
+        new_status = RECONCILE_TRANSITIONS.get(key, status)
+        if new_status == DROP_ROW:
+            transitions.deletes.append((video_id,))
+            dropped.add(video_id)
+        elif new_status != status:
+            transitions.status_updates.append((new_status, video_id))
+
+    for video_id, entry in remote_files.items():
+        if entry.size is None:
+            continue
+        if video_id not in catalog or video_id in dropped:
+            transitions.inserts.append(
+                (video_id, VideoStatus.NOT_DOWNLOADED, entry.size, entry.modify)
+            )
+            continue
+        _, size, mtime = catalog[video_id]
+        comparable = comparable_mtimes(mtime, entry.modify)
+        if entry.size != size or (comparable and not same_mtime(mtime, entry.modify)):
+            transitions.changes.append(
+                (VideoStatus.UPDATED, entry.size, entry.modify, video_id)
+            )
+        elif entry.modify is not None and not comparable:
+            transitions.mtime_updates.append((entry.modify, video_id))
+    return transitions
+
+
+def apply_transitions(transitions: Transitions):
+    """Writes a batch of transitions in a single transaction."""
+    cur.executemany("DELETE FROM videos WHERE video_id = ?", transitions.deletes)
+    cur.executemany(
+        "UPDATE videos SET video_status = ? WHERE video_id = ?",
+        transitions.status_updates,
+    )
+    cur.executemany(
+        "INSERT INTO videos (video_id, video_status, video_remote_size, video_remote_mtime) VALUES (?, ?, ?, ?)",
+        transitions.inserts,
+    )
+    cur.executemany(
+        "UPDATE videos SET video_status = ?, video_remote_size = ?, video_remote_mtime = COALESCE(?, video_remote_mtime) WHERE video_id = ?",
+        transitions.changes,
+    )
+    cur.executemany(
+        "UPDATE videos SET video_remote_mtime = ? WHERE video_id = ?",
+        transitions.mtime_updates,
+    )
+    conn.commit()
+
+
+def stage_remote_listing(remote_files: Iterable[RemoteEntry]):
+    """Bulk loads remote files into the remote_listing temp table.
+
+    remote_files may be a generator; it is consumed row by row.
+    """
+    cur.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS remote_listing (video_id STRING PRIMARY KEY, size INTEGER, modify TEXT)"
+    )
+    cur.execute("DELETE FROM remote_listing")
+    cur.executemany(
+        "INSERT OR REPLACE INTO remote_listing (video_id, size, modify) VALUES (?, ?, ?)",
+        ((entry.name, entry.size, entry.modify) for entry in remote_files),
+    )
+
+
+def reconcile_in_sql(local_files: Iterable[str]):
+    """Applies the same transitions as diff_catalog, computed by SQLite.
+
+    Works on the listing staged by stage_remote_listing. The local listing
+    is bulk loaded into a temp table and RECONCILE_TRANSITIONS is joined
+    against the catalog, so memory stays flat however large the catalog
+    grows. Listed rows are stamped with a new scan generation; rows left
+    with an older generation disappeared from the remote and are swept
+    through the videos_status_scan index, so only rows that can change are
+    visited. Requires SQLite 3.33+ for UPDATE ... FROM.
+    """
+    generation = next_scan_generation()
+    cur.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS local_listing (video_id STRING PRIMARY KEY)"
+    )
+    cur.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS reconcile_transitions (status INTEGER, in_remote INTEGER, in_local INTEGER, new_status INTEGER)"
+    )
+    cur.execute("DELETE FROM local_listing")
+    cur.execute("DELETE FROM reconcile_transitions")
+    cur.executemany(
+        "INSERT OR IGNORE INTO local_listing (video_id) VALUES (?)",
+        ((video_id,) for video_id in local_files),
+    )
+    cur.executemany(
+        "INSERT INTO reconcile_transitions VALUES (?, ?, ?, ?)",
+        (key + (new_status,) for key, new_status in RECONCILE_TRANSITIONS.items()),
+    )
+
+    # Mark
+    cur.execute(
+        "UPDATE videos SET last_seen_scan = ? FROM remote_listing r WHERE r.video_id = videos.video_id",
+        (generation,),
+    )
+    # Status transitions of listed rows, then sweep of unlisted ones. Each
+    # statement only sees rows of its own generation, so every row makes
+    # exactly one transition from its status before this scan.
+    for generation_test, in_remote in (("= ?", 1), ("< ?", 0)):
+        cur.execute(
+            f"""
+            UPDATE videos SET video_status = t.new_status
+            FROM reconcile_transitions t
+            WHERE t.status = videos.video_status
+                AND videos.last_seen_scan {generation_test}
+                AND t.in_remote = ?
+                AND t.in_local = EXISTS (
+                    SELECT 1 FROM local_listing l WHERE l.video_id = videos.video_id
+                )
+            """,
+            (generation, in_remote),
+        )
+    cur.execute("DELETE FROM videos WHERE video_status = ?", (DROP_ROW,))
+    # New remote files
+    cur.execute(
+        """
+        INSERT INTO videos (video_id, video_status, video_remote_size, video_remote_mtime, last_seen_scan)
+        SELECT r.video_id, ?, r.size, r.modify, ? FROM remote_listing r
+        WHERE r.size IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM videos v WHERE v.video_id = r.video_id
+        )
+        """,
+        (VideoStatus.NOT_DOWNLOADED, generation),
+    )
+    # Remote files whose size or modify time changed, see same_mtime
+    cur.execute(
+        """
+        UPDATE videos SET
+            video_status = ?,
+            video_remote_size = r.size,
+            video_remote_mtime = COALESCE(r.modify, videos.video_remote_mtime)
+        FROM remote_listing r
+        WHERE r.video_id = videos.video_id
+            AND r.size IS NOT NULL
+            AND (
+                r.size IS NOT videos.video_remote_size
+                OR (
+                    length(r.modify) = length(videos.video_remote_mtime)
+                    AND CASE length(r.modify)
+                        WHEN 12 THEN substr(r.modify, 5) != substr(videos.video_remote_mtime, 5)
+                        ELSE r.modify != videos.video_remote_mtime
+                    END
+                )
+            )
+        """,
+        (VideoStatus.UPDATED,),
+    )
+    # First modify time seen for rows created before it was recorded, or
+    # one of another precision after the listing source changed
+    cur.execute("""
+        UPDATE videos SET video_remote_mtime = r.modify
+        FROM remote_listing r
+        WHERE r.video_id = videos.video_id
+            AND r.size IS NOT NULL
+            AND r.modify IS NOT NULL
+            AND length(r.modify) IS NOT length(videos.video_remote_mtime)
+        """)
+    conn.commit()
+
+
+def scan_remote(
+    ftp_client: ftplib.FTP, remote_dir: str, local_files: dict[str, LocalFile]
+) -> str | None:
+    """Reconciles the catalog with the remote listing.
+
+    With SKIP_UNCHANGED_SCANS, returns the fingerprint of the listing, see
+    ListingFingerprint; otherwise None.
+    """
+    fingerprint = ListingFingerprint() if SKIP_UNCHANGED_SCANS else None
+
+    def remote_entries() -> Iterator[RemoteEntry]:
+        for entry in iter_remote_files(ftp_client):
+            if fingerprint is not None:
+                fingerprint.add(entry)
+            yield entry
+
+    try:
+        if RECONCILE_MODE == "sql":
+            unsized = []
+
+            def listed_files() -> Iterator[RemoteEntry]:
+                for entry in remote_entries():
+                    if entry.type == "file":
+                        if entry.size is None:
+                            unsized.append(entry)
+                        yield entry
+
+            stage_remote_listing(listed_files())
+            if unsized:
+                probed = complete_unsized(ftp_client, unsized)
+                cur.executemany(
+                    "UPDATE remote_listing SET size = ?, modify = ? WHERE video_id = ?",
+                    (
+                        (entry.size, entry.modify, entry.name)
+                        for entry in probed.values()
+                    ),
+                )
+            reconcile_in_sql(local_files)
+        else:
+            remote_files = {
+                entry.name: entry for entry in remote_entries() if entry.type == "file"
+            }
+            unsized = [entry for entry in remote_files.values() if entry.size is None]
+            if unsized:
+                remote_files.update(complete_unsized(ftp_client, unsized))
+
+            catalog = {
+                row["video_id"]: (
+                    row["video_status"],
+                    row["video_remote_size"],
+                    row["video_remote_mtime"],
+                )
+                for row in cur.execute(
+                    "SELECT video_id, video_status, video_remote_size, video_remote_mtime FROM videos"
+                )
+            }
+            apply_transitions(diff_catalog(remote_files, local_files, catalog))
+    except Exception as e:
+        logging.error(f"Error scanning remote directory {remote_dir}: {e}")
+        sys.exit(1)
+    return fingerprint.value() if fingerprint is not None else None
+
+
+def local_file_status(row: sqlite3.Row, local_file: LocalFile | None) -> int:
+    """Checks a DOWNLOADED file against the local copy.
+
+    A missing file is downloaded again and a shorter one (truncated since)
+    is resumed. A longer one, or with VERIFY_LOCAL_MTIME one modified
+    since it was downloaded, is replaced.
+    """
+    if local_file is None:
+        return VideoStatus.NOT_DOWNLOADED
+    remote_size = row["video_remote_size"]
+    if remote_size is not None and local_file.size < remote_size:
+        return VideoStatus.PARTIAL
+    if remote_size is not None and local_file.size > remote_size:
+        return VideoStatus.UPDATED
+    if (
+        VERIFY_LOCAL_MTIME
+        and row["video_local_mtime"] is not None
+        and local_file.mtime != row["video_local_mtime"]
+    ):
+        return VideoStatus.UPDATED
+    return VideoStatus.DOWNLOADED
+
+
+def scan_local(local_files: dict[str, LocalFile]):
+    try:
+        cur.execute(
+            "SELECT * FROM videos WHERE video_status = ?",
+            (VideoStatus.DOWNLOADED,),
+        )
+        rows: list[sqlite3.Row] = cur.fetchall()
+
+        for row in rows:
+            status = local_file_status(row, local_files.get(row["video_id"]))
+            if status != VideoStatus.DOWNLOADED:
                 cur.execute(
-                    "UPDATE videos SET video_status = ?, video_remote_size = ? WHERE video_id = ?",
-                    (VideoStatus.UPDATED, remote_file_size, remote_file),
+                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
+                    (status, row["video_id"]),
                 )
         conn.commit()
+
     except Exception as e:
-        logging.error(f"Error scanning remote directory {remote_dir}: {e}")
+        logging.error(f"Error scanning local directory: {e}")
         sys.exit(1)
 
 
-def scan_local():
-    try:
-        local_files = get_local_files()
-        cur.execute(
-            "SELECT * FROM videos WHERE video_status = ?",
-            (VideoStatus.DOWNLOADED,),
-        )
-        rows: list[sqlite3.Row] = cur.fetchall()
+def walk_local(
+    relative_dir: str = "", on_directory=None
+) -> Iterator[tuple[str, LocalFile]]:
+    """Yields (path relative to LOCAL_DIR, LocalFile) for every file below
+    relative_dir, except the staging folder.
+
+    Stats come from os.scandir, which on most platforms has them from the
+    directory read itself. on_directory is called with each folder before
+    it is read. Unreadable folders are skipped, as os.walk does.
+    """
+    to_visit = [relative_dir]
+    while to_visit:
+        relative_dir = to_visit.pop()
+        try:
+            if on_directory is not None:
+                on_directory(relative_dir)
+            with os.scandir(local_path_for(relative_dir)) as entries:
+                for entry in entries:
+                    path = remote_path_join(relative_dir, entry.name)
+                    if path == STAGING_DIR:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        to_visit.append(path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        yield path, LocalFile(
+                            stat.st_size, stat.st_mtime_ns, entry.inode()
+                        )
+        except OSError:
+            continue
+
+
+def local_snapshot() -> dict[str, LocalFile]:
+    """Maps each local file id to its size, mtime and inode.
+
+    With RECURSIVE the id is the path relative to LOCAL_DIR with "/"
+    separators, matching the remote ids; otherwise it is the file name.
+    The tree is walked once per call, unless LOCAL_WATCH keeps a LocalIndex
+    current.
+    """
+    if local_index is not None:
+        files = local_index.snapshot()
+    else:
+        files = dict(walk_local())
+    if RECURSIVE:
+        return files
+    return {path.rpartition("/")[2]: local_file for path, local_file in files.items()}
+
+
+# inotify(7) event bits
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+LOCAL_WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class LocalIndex:
+    """Keeps the local snapshot current with Linux inotify instead of a walk
+    per cycle.
+
+    The first snapshot walks LOCAL_DIR, watching every folder, and keeps the
+    files in memory. A daemon thread then collects the paths inotify
+    reports, and each later snapshot only stats those again.
+    An event queue overflow, a folder moved within the tree or one that
+    cannot be watched brings back a full walk.
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.lock = threading.Lock()
+        self.watches: dict[int, str] = {}  # watch descriptor -> relative dir
+        self.dirty: set[str] = set()
+        self.needs_walk = True
+        self.files: dict[str, LocalFile] = {}
+        threading.Thread(target=self.read_events, daemon=True).start()
+
+    def watch(self, relative_dir: str):
+        wd = self.libc.inotify_add_watch(
+            self.fd,
+            os.fsencode(local_path_for(relative_dir)),
+            LOCAL_WATCH_MASK | IN_ONLYDIR,
+        )
+        with self.lock:
+            if wd < 0:
+                # Unwatched folders would go stale, walk again next cycle
+                self.needs_walk = True
+            else:
+                self.watches[wd] = relative_dir
+
+    def read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                with self.lock:
+                    directory = self.watches.get(wd)
+                    if mask & IN_Q_OVERFLOW or (
+                        mask & IN_ISDIR and mask & IN_MOVED_FROM
+                    ):
+                        self.needs_walk = True
+                    elif mask & IN_IGNORED:
+                        self.watches.pop(wd, None)
+                    elif directory is not None:
+                        path = remote_path_join(directory, name)
+                        if path != STAGING_DIR:
+                            self.dirty.add(path)
+
+    def refresh(self, path: str, watched: set[str]) -> Iterator[tuple[str, LocalFile]]:
+        """Drops path, and everything under it if it was a watched folder,
+        then stats it again. New folders are watched as they are walked."""
+        self.files.pop(path, None)
+        if path in watched:
+            prefix = f"{path}/"
+            for indexed in [p for p in self.files if p.startswith(prefix)]:
+                del self.files[indexed]
+        local_path = local_path_for(path)
+        if os.path.isdir(local_path) and not os.path.islink(local_path):
+            yield from walk_local(path, self.watch)
+        elif os.path.isfile(local_path):
+            stat = os.stat(local_path)
+            yield path, LocalFile(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def snapshot(self) -> dict[str, LocalFile]:
+        with self.lock:
+            needs_walk, self.needs_walk = self.needs_walk, False
+            dirty, self.dirty = self.dirty, set()
+            watched = set(self.watches.values())
+            if needs_walk:
+                self.watches.clear()
+        if needs_walk:
+            self.files = dict(walk_local(on_directory=self.watch))
+        else:
+            updated = [item for path in dirty for item in self.refresh(path, watched)]
+            self.files.update(updated)
+        return dict(self.files)
+
 
-        for row in rows:
-            if row["video_id"] not in local_files:
-                cur.execute(
-                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
-                    (VideoStatus.NOT_DOWNLOADED, row["video_id"]),
-                )
-        conn.commit()
+def local_path_for(video_id: str) -> str:
+    return os.path.join(LOCAL_DIR, *video_id.split("/") if video_id else [])
+
+
+# Folder of LOCAL_DIR, so on the same filesystem, where downloads are written
+# until they are complete
+STAGING_DIR = ".sync-staging"
+# Appended to staged file names: the dot only hides STAGING_DIR on Unix, and
+# tools that scan LOCAL_DIR for *.mxf must not pick up half-written files
+STAGING_SUFFIX = ".part"
 
-    except Exception as e:
-        logging.error(f"Error scanning local directory: {e}")
-        sys.exit(1)
 
+def staging_path_for(video_id: str) -> str:
+    return local_path_for(remote_path_join(STAGING_DIR, video_id)) + STAGING_SUFFIX
 
-def get_local_files():
-    """Recursively gets all local file paths and sizes."""
-    local_file_paths = []
-    if not os.path.exists(LOCAL_DIR):
-        return []
 
-    for root, _, files in os.walk(LOCAL_DIR):
-        for file in files:
-            file_path = os.path.normpath(os.path.join(root, file))
-            local_file_paths.append(file_path)
-    local_file_ids = []
-    for local_path in local_file_paths:
-        local_file_id = os.path.basename(local_path)
-        local_file_ids.append(local_file_id)
-    return local_file_ids
+def remove_stale_staging():
+    """Deletes staged files no PARTIAL row will resume, such as those of
+    files that changed or disappeared on the remote since, or anything else
+    found in STAGING_DIR, then the folders left empty."""
+    resumable = {
+        staging_path_for(row["video_id"])
+        for row in cur.execute(
+            "SELECT video_id FROM videos WHERE video_status = ?",
+            (VideoStatus.PARTIAL,),
+        )
+    }
+    for directory, _, names in os.walk(local_path_for(STAGING_DIR), topdown=False):
+        for name in names:
+            staged_path = os.path.join(directory, name)
+            if staged_path not in resumable:
+                try:
+                    os.remove(staged_path)
+                    logging.info(f"Removed stale staged file {staged_path}")
+                except OSError as e:
+                    logging.error(f"Error deleting file {staged_path}: {e}")
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # Not empty
 
 
 def preview_changes():
@@ -143,6 +1483,7 @@ def preview_changes():
     download_count = 0
     delete_count = 0
     update_count = 0
+    resume_count = 0
 
     rows: list[sqlite3.Row] = cur.execute(
         "SELECT * FROM videos ORDER BY video_id ASC"
@@ -159,8 +1500,16 @@ def preview_changes():
         elif video_status == VideoStatus.UPDATED:
             table.append(["Update", video_id])
             update_count += 1
+        elif video_status == VideoStatus.PARTIAL:
+            table.append(["Resume", video_id])
+            resume_count += 1
 
-    if download_count == 0 and delete_count == 0 and update_count == 0:
+    if (
+        download_count == 0
+        and delete_count == 0
+        and update_count == 0
+        and resume_count == 0
+    ):
         if PREVIEW_MODE:
             print("No changes detected")
         return
@@ -171,66 +1520,1274 @@ def preview_changes():
     print(tabulate.tabulate(table, headers=headers, tablefmt="fancy_grid"))
     print(f"Total {download_count} files to download.")
     print(f"Total {update_count} files to update.")
+    print(f"Total {resume_count} files to resume.")
     print(f"Total {delete_count} files to delete.")
     print("===============================")
 
 
-def mirror_ftp_directory(ftp_client: ftplib.FTP):
+class ResumeMismatch(Exception):
+    """The bytes re-fetched before a resume offset differ from the local copy."""
+
+
+class BufferPool:
+    """Receive buffers of RECV_BLOCK_SIZE bytes, reused across blocks and
+    transfers so the receive path does not allocate per block."""
+
+    def __init__(self):
+        self.free: list[bytearray] = []
+        self.lock = threading.Lock()
+
+    def get(self) -> bytearray:
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return bytearray(RECV_BLOCK_SIZE)
+
+    def put(self, buffer: bytearray):
+        # Buffers of an earlier block size are left to the garbage collector
+        if len(buffer) == RECV_BLOCK_SIZE:
+            with self.lock:
+                self.free.append(buffer)
+
+
+receive_buffers = BufferPool()
+
+
+def receive_into_buffers(data_conn, limit: int | None = None) -> Iterator[memoryview]:
+    """Reads a data connection with recv_into, a pooled buffer at a time.
+
+    Each buffer is filled before it is yielded, so writes are large. The
+    caller gives it back with receive_buffers.put(view.obj) once written.
+    Stops at the end of the transfer or after limit bytes.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        buffer = receive_buffers.get()
+        view = memoryview(buffer)
+        if remaining is not None:
+            view = view[:remaining]
+        filled = 0
+        while filled < len(view):
+            received = data_conn.recv_into(view[filled:])
+            if not received:
+                break
+            filled += received
+        if not filled:
+            receive_buffers.put(buffer)
+            return
+        yield view[:filled]
+        if remaining is not None:
+            remaining -= filled
+        if filled < len(view):
+            return
+
+
+def retrieve_into(ftp_client: ftplib.FTP, command: str, rest: int | None, write):
+    """Like retrbinary, but receives into pooled buffers of RECV_BLOCK_SIZE.
+
+    write(view, release) must call release() once view has been written.
+    """
+    ftp_client.voidcmd("TYPE I")
+    with ftp_client.transfercmd(command, rest) as data_conn:
+        for view in receive_into_buffers(data_conn):
+            write(view, functools.partial(receive_buffers.put, view.obj))
+    return ftp_client.voidresp()
+
+
+class WriteBehindFile:
+    """Hands writes to a writer thread through a bounded queue of blocks.
+
+    write() returns once the block is queued, so the receive loop keeps
+    reading while the disk catches up, and blocks when buffers blocks are
+    already waiting. An error on the writer thread is raised by the next
+    write() or by close().
+    """
+
+    def __init__(self, local_file, buffers: int):
+        self.local_file = local_file
+        self.blocks: queue.Queue[tuple | None] = queue.Queue(maxsize=buffers)
+        self.error: OSError | None = None
+        self.thread = threading.Thread(target=self.write_blocks, daemon=True)
+        self.thread.start()
+
+    def write_blocks(self):
+        while (item := self.blocks.get()) is not None:
+            block, release = item
+            # After an error keep draining, so write() never blocks forever
+            if self.error is None:
+                try:
+                    self.local_file.write(block)
+                except OSError as e:
+                    self.error = e
+            if release is not None:
+                release()
+
+    def write(self, block: bytes, release=None):
+        """Queues block; release, if given, is called once it is written."""
+        if self.error is not None:
+            raise self.error
+        self.blocks.put((block, release))
+
+    def close(self):
+        self.blocks.put(None)
+        self.thread.join()
+        self.local_file.close()
+        if self.error is not None:
+            raise self.error
+
+
+# Bytes written between page cache drops with DROP_CACHE
+DROP_CACHE_WINDOW = 32 * 1024 * 1024
+
+
+class DropBehind:
+    """With DROP_CACHE, drops what a transfer has written to fd since start
+    from the page cache as it goes, so large videos do not evict the memory
+    of other processes.
+
+    posix_fadvise(DONTNEED) starts writeback of dirty pages but only drops
+    clean ones, so each window is advised when it has been written and
+    again a window later, once it is usually on disk. finish() waits for
+    the rest to be written and drops it.
+    """
+
+    def __init__(self, fd: int, start: int):
+        self.enabled = DROP_CACHE and hasattr(os, "posix_fadvise")
+        # Own descriptor, so finish() works after the file is closed
+        self.fd = os.dup(fd) if self.enabled else -1
+        self.start = start
+        self.position = start
+        self.advised = start
+
+    def advance(self, position: int):
+        self.position = position
+        if not self.enabled or position - self.advised < DROP_CACHE_WINDOW:
+            return
+        begin = max(self.start, self.advised - DROP_CACHE_WINDOW)
+        os.posix_fadvise(self.fd, begin, position - begin, os.POSIX_FADV_DONTNEED)
+        self.advised = position
+
+    def finish(self):
+        if not self.enabled:
+            return
+        try:
+            os.fdatasync(self.fd)
+            os.posix_fadvise(
+                self.fd,
+                self.start,
+                self.position - self.start,
+                os.POSIX_FADV_DONTNEED,
+            )
+        finally:
+            os.close(self.fd)
+
+
+# O_DIRECT transfers need buffers, offsets and lengths aligned to the
+# logical block size of the disk; 4 KiB covers current ones
+DIRECT_IO_ALIGNMENT = 4096
+DIRECT_IO_BLOCK_SIZE = 1024 * 1024
+
+
+class DirectFile:
+    """Writes a file sequentially from offset with O_DIRECT, bypassing the
+    page cache.
+
+    Received blocks are gathered into a page-aligned mmap buffer, written
+    whenever it fills. The bytes up to the first aligned offset of a resumed
+    file and the tail left at close() go through a normal descriptor, so the
+    file is always a prefix of the remote one.
+    """
+
+    def __init__(self, local_path: str, offset: int):
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(local_path, flags | (0 if offset else os.O_TRUNC), 0o666)
+        try:
+            self.direct_fd = os.open(local_path, os.O_WRONLY | os.O_DIRECT)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.buffer = mmap.mmap(-1, DIRECT_IO_BLOCK_SIZE)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.position = offset
+        self.unaligned = -offset % DIRECT_IO_ALIGNMENT
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def write(self, block: bytes | memoryview):
+        block = memoryview(block)
+        if self.unaligned:
+            head = block[: self.unaligned]
+            write_at(self.fd, head, self.position)
+            self.position += len(head)
+            self.unaligned -= len(head)
+            block = block[len(head) :]
+        while block:
+            taken = min(len(block), DIRECT_IO_BLOCK_SIZE - self.filled)
+            self.view[self.filled : self.filled + taken] = block[:taken]
+            self.filled += taken
+            block = block[taken:]
+            if self.filled == DIRECT_IO_BLOCK_SIZE:
+                write_at(self.direct_fd, self.view, self.position)
+                self.position += DIRECT_IO_BLOCK_SIZE
+                self.filled = 0
+
+    def close(self):
+        try:
+            if self.filled:
+                with self.view[: self.filled] as tail:
+                    write_at(self.fd, tail, self.position)
+        finally:
+            os.close(self.direct_fd)
+            os.close(self.fd)
+            self.view.release()
+            self.buffer.close()
+
+
+def open_transfer_file(local_path: str, offset: int):
+    """Opens local_path to append from offset, with O_DIRECT when DIRECT_IO
+    is set and the platform and filesystem allow it."""
+    if DIRECT_IO and hasattr(os, "O_DIRECT"):
+        try:
+            return DirectFile(local_path, offset)
+        except OSError as e:
+            logging.warning(f"O_DIRECT unavailable for {local_path}: {e}")
+    return open(local_path, "ab" if offset else "wb")
+
+
+# fallocate(2) mode that reserves blocks without changing the file size
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def preallocate(fd: int, offset: int, size: int | None):
+    """With PREALLOCATE, reserves disk blocks for bytes [offset, size) of
+    the file open as fd, so a large download is not fragmented among
+    concurrent ones and a full disk is reported before the transfer.
+
+    Linux fallocate(2) is used with FALLOC_FL_KEEP_SIZE, since the size of a
+    staged file is its resume offset. Where it is missing or unsupported by
+    the filesystem nothing is reserved. Must be called after any truncating
+    open, which would free the reservation.
+    """
+    if (
+        not PREALLOCATE
+        or size is None
+        or size <= offset
+        or not sys.platform.startswith("linux")
+    ):
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    fallocate = libc.fallocate64
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    if fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, size - offset) < 0:
+        errno = ctypes.get_errno()
+        if errno == ENOSPC:
+            raise OSError(errno, os.strerror(errno))
+
+
+class ResumeFile:
+    """The local file of a transfer that starts at offset.
+
+    The RESUME_OVERLAP bytes before offset are requested again (from
+    start); write() compares them with the local copy instead of writing
+    them, and raises ResumeMismatch if they differ. Whatever remains in
+    expected once the transfer ends was never received. With PREALLOCATE
+    the blocks up to size, the remote size when known, are reserved once
+    the file is open.
+    """
+
+    def __init__(
+        self,
+        video_id: str,
+        local_path: str,
+        offset: int,
+        progress,
+        size: int | None = None,
+    ):
+        self.video_id = video_id
+        self.local_path = local_path
+        self.offset = offset
+        self.progress = progress
+        self.start = max(0, offset - RESUME_OVERLAP)
+        self.expected = b""
+        if offset:
+            with open(local_path, "rb") as local_file:
+                local_file.seek(self.start)
+                self.expected = local_file.read(offset - self.start)
+        self.file_size = offset
+        self.local_file = open_transfer_file(local_path, offset)
+        try:
+            preallocate(self.local_file.fileno(), offset, size)
+        except OSError:
+            self.local_file.close()
+            raise
+        self.drop_behind = DropBehind(self.local_file.fileno(), offset)
+        self.write_behind = WRITE_BEHIND_BUFFERS > 0
+        if self.write_behind:
+            self.local_file = WriteBehindFile(self.local_file, WRITE_BEHIND_BUFFERS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        try:
+            self.local_file.close()
+        finally:
+            self.drop_behind.finish()
+
+    def write(self, block: bytes | memoryview, release=None):
+        """Writes a received block; release, if given, is called once the
+        block's buffer may be reused."""
+        if self.expected:
+            overlap = block[: len(self.expected)]
+            if overlap != self.expected[: len(overlap)]:
+                raise ResumeMismatch(
+                    f"{self.video_id} changed before byte {self.offset}"
+                )
+            self.expected = self.expected[len(overlap) :]
+            block = block[len(overlap) :]
+        if block:
+            self.file_size += len(block)
+            if self.write_behind:
+                self.local_file.write(block, release)
+                release = None
+            else:
+                self.local_file.write(block)
+            self.drop_behind.advance(self.file_size)
+            self.progress(self.file_size)
+        if release is not None:
+            release()
+
+
+def retrieve_spliced(ftp_client: ftplib.FTP, command: str, resume: ResumeFile):
+    """Like retrbinary, but moves the data to the file with splice_to_file.
+
+    The resume overlap still goes through resume.write to be compared; only
+    new bytes are spliced. Whatever splice leaves is received as usual,
+    through the same descriptor.
+    """
+    ftp_client.voidcmd("TYPE I")
+    with ftp_client.transfercmd(command, resume.start or None) as data_conn:
+        while resume.expected and (block := data_conn.recv(len(resume.expected))):
+            resume.write(block)
+        if resume.expected or not can_splice(data_conn):
+            while block := data_conn.recv(TRANSFER_BLOCK_SIZE):
+                resume.write(block)
+            return ftp_client.voidresp()
+        fd = os.open(resume.local_path, os.O_WRONLY)
+        drop_behind = DropBehind(fd, resume.file_size)
+
+        def progress(position: int):
+            drop_behind.advance(position)
+            resume.progress(position)
+
+        try:
+            position = splice_to_file(
+                data_conn, fd, resume.file_size, progress=progress
+            )
+            while block := data_conn.recv(TRANSFER_BLOCK_SIZE):
+                write_at(fd, block, position)
+                position += len(block)
+                progress(position)
+        finally:
+            drop_behind.finish()
+            os.close(fd)
+        resume.file_size = position
+    return ftp_client.voidresp()
+
+
+def retrieve_file(
+    ftp_client: ftplib.FTP,
+    video_id: str,
+    local_path: str,
+    offset: int,
+    progress,
+    size: int | None = None,
+):
+    """Downloads video_id into local_path, resuming at offset when it is > 0.
+
+    On resume the last RESUME_OVERLAP bytes before offset are fetched again
+    and compared with the local file before anything is appended. If they
+    differ the remote file changed underneath, and it is downloaded again
+    from the start, as it is when the server refuses REST. progress is
+    called with the local file size after each block. size is the remote
+    size, if known, for PREALLOCATE.
+    """
+    try:
+        with ResumeFile(video_id, local_path, offset, progress, size) as resume:
+            if ZERO_COPY and splice_supported:
+                retrieve_spliced(ftp_client, f"RETR {video_id}", resume)
+            elif RECV_BLOCK_SIZE > 0:
+                retrieve_into(
+                    ftp_client, f"RETR {video_id}", resume.start or None, resume.write
+                )
+            else:
+                ftp_client.retrbinary(
+                    f"RETR {video_id}",
+                    callback=resume.write,
+                    rest=resume.start or None,
+                )
+    except ftplib.error_perm as e:
+        if not offset:
+            raise
+        logging.warning(f"Resume refused for {video_id}, downloading it again: {e}")
+        retrieve_file(ftp_client, video_id, local_path, 0, progress, size)
+        return
+    except ResumeMismatch as e:
+        # The data connection was dropped mid transfer, read its reply
+        try:
+            ftp_client.getresp()
+        except (ftplib.error_temp, ftplib.error_perm):
+            pass
+        logging.warning(f"Resume check failed, downloading it again: {e}")
+        retrieve_file(ftp_client, video_id, local_path, 0, progress, size)
+        return
+    if resume.expected:
+        logging.warning(
+            f"Resume check failed, downloading it again: "
+            f"{video_id} is now shorter than byte {offset}"
+        )
+        retrieve_file(ftp_client, video_id, local_path, 0, progress, size)
+
+
+def prepare_download(row: sqlite3.Row) -> tuple[str, int]:
+    """Returns the staging path a catalog row is downloaded to and the offset
+    to resume it from: the size of the staged file of a PARTIAL row, else 0.
+
+    A PARTIAL row without a staged file is a local copy found shorter than
+    the remote file; it is moved into staging to be resumed there. If it
+    is gone or cannot be moved, the file is downloaded from the start.
+    """
+    video_id = row["video_id"]
+    staged_path = staging_path_for(video_id)
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    offset = 0
+    if row["video_status"] == VideoStatus.PARTIAL:
+        if not os.path.exists(staged_path):
+            local_path = local_path_for(video_id)
+            try:
+                if os.path.getsize(local_path) < (row["video_remote_size"] or 0):
+                    os.replace(local_path, staged_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(
+                    f"Cannot resume {local_path}, downloading it again: {e}"
+                )
+        if os.path.exists(staged_path):
+            offset = os.path.getsize(staged_path)
+    return staged_path, offset
+
+
+def publish_download(row: sqlite3.Row) -> int:
+    """Moves the completed download of a catalog row from staging into
+    place, replacing the previous copy in one step, and returns its mtime.
+
+    A staged file that does not have the remote size is left for a resume
+    and ftplib.error_proto is raised.
+    """
+    video_id = row["video_id"]
+    staged_path = staging_path_for(video_id)
+    size = os.path.getsize(staged_path)
+    remote_size = row["video_remote_size"]
+    if remote_size is not None and size != remote_size:
+        raise ftplib.error_proto(
+            f"{video_id} has {size} bytes staged, expected {remote_size}"
+        )
+    local_path = local_path_for(video_id)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    os.replace(staged_path, local_path)
+    return os.stat(local_path).st_mtime_ns
+
+
+def download_file(ftp_client: ftplib.FTP, row: sqlite3.Row, progress):
+    """Downloads the file of a catalog row, resuming a PARTIAL one."""
+    local_path, offset = prepare_download(row)
+    retrieve_file(
+        ftp_client,
+        row["video_id"],
+        local_path,
+        offset,
+        progress,
+        row["video_remote_size"],
+    )
+
+
+# Bytes asked from the data connection at a time by ranged transfers
+TRANSFER_BLOCK_SIZE = 64 * 1024
+
+# Serializes seek + write on platforms without os.pwrite
+write_at_lock = threading.Lock()
+
+
+def write_at(fd: int, data: bytes, position: int):
+    """Writes all of data at position without moving a shared file offset."""
+    if hasattr(os, "pwrite"):
+        while data:
+            written = os.pwrite(fd, data, position)
+            data = data[written:]
+            position += written
+        return
+    with write_at_lock:
+        os.lseek(fd, position, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data) :]
+
+
+# Bytes moved per splice call, and the pipe capacity asked for to match
+SPLICE_BLOCK_SIZE = 1024 * 1024
+
+# Cleared when the kernel refuses splice, so later transfers skip it
+splice_supported = hasattr(os, "splice")
+
+
+def can_splice(data_conn) -> bool:
+    """splice needs a plain (not TLS) data socket in blocking mode."""
+    return (
+        splice_supported
+        and type(data_conn) is socket.socket
+        and data_conn.gettimeout() is None
+    )
+
+
+def splice_to_file(
+    data_conn: socket.socket,
+    fd: int,
+    position: int,
+    end: int | None = None,
+    progress=None,
+) -> int:
+    """Moves data from data_conn to fd at position until end (or the end of
+    the transfer) through a pipe with os.splice, so the bytes never enter
+    Python. Returns the position reached.
+
+    If the kernel refuses splice for these descriptors it is turned off,
+    and the position reached so far is returned for the caller to carry on
+    with recv.
+    """
+    global splice_supported
+    import fcntl  # Linux only, as is splice
+
+    read_end, write_end = os.pipe()
+    try:
+        try:
+            block_size = fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, SPLICE_BLOCK_SIZE)
+        except OSError:
+            # Above /proc/sys/fs/pipe-max-size; keep the default capacity
+            block_size = TRANSFER_BLOCK_SIZE
+        while end is None or position < end:
+            want = block_size if end is None else min(block_size, end - position)
+            try:
+                piped = os.splice(data_conn.fileno(), write_end, want)
+            except OSError as e:
+                logging.warning(f"splice unavailable, receiving normally: {e}")
+                splice_supported = False
+                break
+            if not piped:
+                break
+            try:
+                while piped:
+                    written = os.splice(read_end, fd, piped, offset_dst=position)
+                    piped -= written
+                    position += written
+            except OSError as e:
+                logging.warning(f"splice unavailable, receiving normally: {e}")
+                splice_supported = False
+                # Write out what is still in the pipe
+                while piped:
+                    block = os.read(read_end, piped)
+                    write_at(fd, block, position)
+                    piped -= len(block)
+                    position += len(block)
+                break
+            if progress is not None:
+                progress(position)
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+    return position
+
+
+def fetch_range(ftp_client: ftplib.FTP, video_id: str, fd: int, start: int, end: int):
+    """Writes bytes [start, end) of video_id at the same offsets of fd.
+
+    The transfer starts with REST and its data connection is dropped at the
+    range end; the 426 (or 226) reply is then read, so the control channel
+    stays in sync for the next range.
+    """
+    ftp_client.voidcmd("TYPE I")
+    position = start
+    drop_behind = DropBehind(fd, start)
+    try:
+        with ftp_client.transfercmd(
+            f"RETR {video_id}", rest=start or None
+        ) as data_conn:
+            if ZERO_COPY and can_splice(data_conn):
+                position = splice_to_file(
+                    data_conn, fd, position, end, drop_behind.advance
+                )
+            if RECV_BLOCK_SIZE > 0:
+                for view in receive_into_buffers(data_conn, end - position):
+                    write_at(fd, view, position)
+                    position += len(view)
+                    receive_buffers.put(view.obj)
+                    drop_behind.advance(position)
+            while position < end:
+                block = data_conn.recv(min(TRANSFER_BLOCK_SIZE, end - position))
+                if not block:
+                    break
+                write_at(fd, block, position)
+                position += len(block)
+                drop_behind.advance(position)
+    finally:
+        drop_behind.finish()
+    try:
+        ftp_client.getresp()
+    except (ftplib.error_temp, ftplib.error_perm):
+        pass
+    if position < end:
+        raise ftplib.error_proto(f"{video_id} ended at byte {position} of {end}")
+
+
+def use_segments(row: sqlite3.Row) -> bool:
+    """Large files, and files whose segmented download was interrupted, are
+    fetched in segments."""
+    size = row["video_remote_size"]
+    if size is None:
+        return False
+    if SEGMENT_CONNECTIONS > 1 and size > SEGMENT_SIZE:
+        return True
+    return (
+        row["video_status"] == VideoStatus.PARTIAL
+        and cur.execute(
+            "SELECT 1 FROM segments WHERE video_id = ?", (row["video_id"],)
+        ).fetchone()
+        is not None
+    )
+
+
+def download_segments(row: sqlite3.Row, progress):
+    """Downloads a file as SEGMENT_SIZE byte ranges over SEGMENT_CONNECTIONS
+    connections, each range written in place into a preallocated file.
+
+    Ranges are recorded in the segments table and marked done as they
+    complete, so when one fails the others are kept and a later resume of
+    the PARTIAL row only fetches what is missing. progress is called with
+    the bytes of completed ranges. Runs on the main thread; workers only
+    transfer. The file is written in staging, like other downloads.
+    """
+    video_id = row["video_id"]
+    size = row["video_remote_size"]
+    staged_path = staging_path_for(video_id)
+    segments = cur.execute(
+        "SELECT segment_start, segment_end, done FROM segments WHERE video_id = ? ORDER BY segment_start",
+        (video_id,),
+    ).fetchall()
+    resumable = (
+        row["video_status"] == VideoStatus.PARTIAL
+        and segments
+        and segments[-1]["segment_end"] == size
+        and os.path.exists(staged_path)
+        and os.path.getsize(staged_path) == size
+    )
+    if not resumable:
+        cur.execute("DELETE FROM segments WHERE video_id = ?", (video_id,))
+        cur.executemany(
+            "INSERT INTO segments (video_id, segment_start, segment_end, done) VALUES (?, ?, ?, 0)",
+            (
+                (video_id, start, min(start + SEGMENT_SIZE, size))
+                for start in range(0, size, SEGMENT_SIZE)
+            ),
+        )
+        conn.commit()
+        segments = cur.execute(
+            "SELECT segment_start, segment_end, done FROM segments WHERE video_id = ? ORDER BY segment_start",
+            (video_id,),
+        ).fetchall()
+    queued = deque(
+        (segment["segment_start"], segment["segment_end"])
+        for segment in segments
+        if not segment["done"]
+    )
+    done_bytes = sum(
+        segment["segment_end"] - segment["segment_start"]
+        for segment in segments
+        if segment["done"]
+    )
+
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    fd = os.open(
+        staged_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666
+    )
+    try:
+        if not resumable:
+            if PREALLOCATE and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+        pool = FTPPool()
+
+        if ENGINE == "asyncio":
+
+            async def fetch_segment(client: AsyncFTP, start: int, end: int):
+                await client.fetch_range(video_id, fd, start, end)
+
+        else:
+
+            def fetch_segment(start: int, end: int):
+                with pool.connection() as worker_client:
+                    fetch_range(worker_client, video_id, fd, start, end)
+
+        connections = max(1, SEGMENT_CONNECTIONS)
+        pending = {}
+        failure = None
+        with pool, transfer_executor(connections) as executor:
+            while queued or pending:
+                while queued and len(pending) < connections:
+                    segment = queued.popleft()
+                    pending[executor.submit(fetch_segment, *segment)] = segment
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    try:
+                        future.result()
+                    except ftplib.all_errors as e:
+                        failure = failure or e
+                        continue
+                    cur.execute(
+                        "UPDATE segments SET done = 1 WHERE video_id = ? AND segment_start = ?",
+                        (video_id, start),
+                    )
+                    conn.commit()
+                    done_bytes += end - start
+                    progress(done_bytes)
+        if failure is not None:
+            raise failure
+    finally:
+        os.close(fd)
+
+
+# ftplib's default control and listing encoding
+FTP_ENCODING = "utf-8"
+
+# Received bytes an asyncio transfer holds while its disk writes catch up
+ASYNC_WRITE_BATCH = 4 * 1024 * 1024
+
+
+def write_blocks(write, blocks: list[bytes]):
+    for block in blocks:
+        write(block)
+
+
+class AsyncFTP:
+    """A small FTP client on asyncio streams, for ENGINE = "asyncio".
+
+    Covers what the transfer engines need: login, passive data connections,
+    MLSD/LIST/NLST listings, SIZE/MDTM probes and RETR with REST. Replies
+    raise ftplib's error classes, so callers handle both engines alike.
+    """
+
+    def __init__(self):
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.transfer_type = None
+
+    @classmethod
+    async def connect(cls) -> "AsyncFTP":
+        """Opens a logged-in connection with REMOTE_DIR as working directory."""
+        client = cls()
+        client.reader, client.writer = await asyncio.open_connection(FTP_HOST, FTP_PORT)
+        try:
+            await client.getresp()
+            reply = await client.sendcmd(f"USER {FTP_USER}")
+            if reply[0] == "3":
+                reply = await client.sendcmd(f"PASS {FTP_PASSWORD}")
+            if reply[0] != "2":
+                raise ftplib.error_reply(reply)
+            await client.sendcmd(f"CWD {REMOTE_DIR}")
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+    def close(self):
+        self.writer.close()
+
+    async def quit(self):
+        try:
+            await self.sendcmd("QUIT")
+        except ftplib.all_errors:
+            pass
+        self.close()
+
+    async def getline(self) -> str:
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode(FTP_ENCODING).rstrip("\r\n")
+
+    async def getresp(self) -> str:
+        """Reads a reply, multiline ones included, raising as ftplib does."""
+        reply = await self.getline()
+        if reply[3:4] == "-":
+            code = reply[:3]
+            while True:
+                line = await self.getline()
+                reply = f"{reply}\n{line}"
+                if line[:3] == code and line[3:4] != "-":
+                    break
+        if reply[:1] in ("1", "2", "3"):
+            return reply
+        if reply[:1] == "4":
+            raise ftplib.error_temp(reply)
+        if reply[:1] == "5":
+            raise ftplib.error_perm(reply)
+        raise ftplib.error_proto(reply)
+
+    async def sendcmd(self, command: str) -> str:
+        self.writer.write(f"{command}\r\n".encode(FTP_ENCODING))
+        await self.writer.drain()
+        return await self.getresp()
+
+    async def voidresp(self) -> str:
+        reply = await self.getresp()
+        if reply[0] != "2":
+            raise ftplib.error_reply(reply)
+        return reply
+
+    async def set_type(self, transfer_type: str):
+        if self.transfer_type != transfer_type:
+            await self.sendcmd(f"TYPE {transfer_type}")
+            self.transfer_type = transfer_type
+
+    async def transfercmd(
+        self, command: str, rest: int | None = None
+    ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Opens a passive data connection and starts command on it.
+
+        Like ftplib, the address in the PASV reply is ignored in favour of
+        FTP_HOST.
+        """
+        _, port = ftplib.parse227(await self.sendcmd("PASV"))
+        data_reader, data_writer = await asyncio.open_connection(FTP_HOST, port)
+        try:
+            if rest is not None:
+                await self.sendcmd(f"REST {rest}")
+            reply = await self.sendcmd(command)
+            if reply[0] == "2":
+                reply = await self.getresp()
+            if reply[0] != "1":
+                raise ftplib.error_reply(reply)
+        except BaseException:
+            data_writer.close()
+            raise
+        return data_reader, data_writer
+
+    async def lines(self, command: str) -> list[str]:
+        await self.set_type("A")
+        data_reader, data_writer = await self.transfercmd(command)
+        try:
+            data = await data_reader.read()
+        finally:
+            data_writer.close()
+        await self.voidresp()
+        return data.decode(FTP_ENCODING).splitlines()
+
+    async def listing(self, path: str = "") -> list[RemoteEntry]:
+        """Lists a directory like iter_remote_listing, except for STAT_LISTING,
+        which needs no data connection and so gains nothing here."""
+        global mlsd_supported
+        if mlsd_supported is None:
+            try:
+                mlsd_supported = features_include_mlst(await self.sendcmd("FEAT"))
+            except ftplib.error_perm:
+                mlsd_supported = False
+        if mlsd_supported:
+            entries = map(parse_mlsd_line, await self.lines(f"MLSD {path}".rstrip()))
+            return [entry for entry in entries if entry is not None]
+
+        try:
+            lines = [
+                line
+                for line in await self.lines(f"LIST {path}".rstrip())
+                if line.strip() and not line.lower().startswith("total ")
+            ]
+            entries = [parse_list_line(line) for line in lines]
+            if not entries or entries[0] is not None:
+                return [entry for entry in entries if entry is not None]
+        except ftplib.error_perm:
+            pass
+
+        # Unknown LIST format, names only
+        names = [
+            line.rsplit("/", 1)[-1]
+            for line in await self.lines(f"NLST {path}".rstrip())
+        ]
+        return [RemoteEntry(name, None, None, "file") for name in names if name]
+
+    async def probe(self, name: str, facts: tuple[str, ...] = ("size",)) -> RemoteEntry:
+        """Like probe_file."""
+        await self.set_type("I")
+        values = dict.fromkeys(PROBE_COMMANDS)
+        for fact in facts:
+            try:
+                reply = await self.sendcmd(f"{PROBE_COMMANDS[fact]} {name}")
+            except ftplib.error_perm:
+                continue
+            values[fact] = parse_probe_reply(fact, reply)
+        return RemoteEntry(name, values["size"], values["modify"], "file")
+
+    async def receive_to_disk(
+        self, data_reader: asyncio.StreamReader, write, limit: int | None = None
+    ) -> int:
+        """Reads a data connection to its end, or limit bytes, and calls
+        write(block) for each block on a worker thread, so disk writes never
+        stall the event loop. Returns the number of bytes received.
+
+        Receiving goes on while blocks are written: the blocks that arrive
+        meanwhile are handed to the thread together once it is done, which
+        keeps the number of thread hops low, and receiving waits once
+        ASYNC_WRITE_BATCH bytes are waiting.
+        """
+        loop = asyncio.get_running_loop()
+        received = 0
+        blocks: list[bytes] = []
+        waiting = 0
+        writing = None
+        try:
+            while limit is None or received < limit:
+                size = TRANSFER_BLOCK_SIZE
+                if limit is not None:
+                    size = min(size, limit - received)
+                block = await data_reader.read(size)
+                if not block:
+                    break
+                received += len(block)
+                blocks.append(block)
+                waiting += len(block)
+                if writing is not None and (
+                    writing.done() or waiting >= ASYNC_WRITE_BATCH
+                ):
+                    await asyncio.shield(writing)
+                    writing = None
+                if writing is None:
+                    writing = loop.run_in_executor(None, write_blocks, write, blocks)
+                    blocks, waiting = [], 0
+            if writing is not None:
+                await asyncio.shield(writing)
+            if blocks:
+                writing = loop.run_in_executor(None, write_blocks, write, blocks)
+                await asyncio.shield(writing)
+        finally:
+            if writing is not None:
+                # On errors and cancellation too, the file must not be
+                # closed under the blocks being written
+                await asyncio.wait([writing])
+        return received
+
+    async def retrieve(
+        self,
+        video_id: str,
+        local_path: str,
+        offset: int,
+        progress,
+        size: int | None = None,
+    ):
+        """Like retrieve_file. Opening, writing and closing the file run on
+        worker threads."""
+        await self.set_type("I")
+        try:
+            resume = await asyncio.to_thread(
+                ResumeFile, video_id, local_path, offset, progress, size
+            )
+            try:
+                data_reader, data_writer = await self.transfercmd(
+                    f"RETR {video_id}", resume.start or None
+                )
+                try:
+                    await self.receive_to_disk(data_reader, resume.write)
+                finally:
+                    data_writer.close()
+                await self.voidresp()
+            finally:
+                await asyncio.shield(asyncio.to_thread(resume.close))
+        except ftplib.error_perm as e:
+            if not offset:
+                raise
+            logging.warning(f"Resume refused for {video_id}, downloading it again: {e}")
+            await self.retrieve(video_id, local_path, 0, progress, size)
+            return
+        except ResumeMismatch as e:
+            try:
+                await self.getresp()
+            except (ftplib.error_temp, ftplib.error_perm):
+                pass
+            logging.warning(f"Resume check failed, downloading it again: {e}")
+            await self.retrieve(video_id, local_path, 0, progress, size)
+            return
+        if resume.expected:
+            logging.warning(
+                f"Resume check failed, downloading it again: "
+                f"{video_id} is now shorter than byte {offset}"
+            )
+            await self.retrieve(video_id, local_path, 0, progress, size)
+
+    async def download(self, row: sqlite3.Row) -> sqlite3.Row:
+        """Like download_file, without progress output."""
+        local_path, offset = await asyncio.to_thread(prepare_download, row)
+        await self.retrieve(
+            row["video_id"],
+            local_path,
+            offset,
+            lambda size: None,
+            row["video_remote_size"],
+        )
+        return row
+
+    async def fetch_range(self, video_id: str, fd: int, start: int, end: int):
+        """Like fetch_range, writing on worker threads."""
+        await self.set_type("I")
+        data_reader, data_writer = await self.transfercmd(
+            f"RETR {video_id}", start or None
+        )
+        position = start
+        drop_behind = DropBehind(fd, start)
+
+        def write(block: bytes):
+            # Calls are sequential, receive_to_disk awaits each one
+            nonlocal position
+            write_at(fd, block, position)
+            position += len(block)
+            drop_behind.advance(position)
+
+        try:
+            await self.receive_to_disk(data_reader, write, end - start)
+        finally:
+            data_writer.close()
+            await asyncio.shield(asyncio.to_thread(drop_behind.finish))
+        try:
+            await self.getresp()
+        except (ftplib.error_temp, ftplib.error_perm):
+            pass
+        if position < end:
+            raise ftplib.error_proto(f"{video_id} ended at byte {position} of {end}")
+
+
+class AsyncEngine:
+    """Runs AsyncFTP tasks on an event loop thread, used like an executor.
+
+    submit(task, *args) runs task(client, *args) with a logged-in client and
+    returns a concurrent.futures.Future, so callers wait on it as on thread
+    pool futures. At most connections tasks run at once, each on its own
+    connection; connections are reused between tasks and closed when a
+    task fails.
+    """
+
+    def __init__(self, connections: int):
+        self.loop = asyncio.new_event_loop()
+        self.slots = asyncio.Semaphore(max(1, connections))
+        self.idle: list[AsyncFTP] = []
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def submit(self, task, *args):
+        return asyncio.run_coroutine_threadsafe(self.run(task, *args), self.loop)
+
+    async def run(self, task, *args):
+        async with self.slots:
+            client = self.idle.pop() if self.idle else await AsyncFTP.connect()
+            try:
+                result = await task(client, *args)
+            except BaseException:
+                # FTP errors, or a cancellation mid transfer
+                client.close()
+                raise
+            self.idle.append(client)
+            return result
+
+    async def close(self):
+        running = [
+            task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+        ]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for client in self.idle:
+            await client.quit()
+
+
+def transfer_executor(connections: int):
+    """The executor that runs a call site's parallel FTP tasks: an
+    AsyncEngine with ENGINE = "asyncio", else a thread pool."""
+    if ENGINE == "asyncio":
+        return AsyncEngine(connections)
+    return ThreadPoolExecutor(max(1, connections))
+
+
+# Progress label of each status that needs a download
+DOWNLOAD_ACTIONS = {
+    VideoStatus.NOT_DOWNLOADED: "DOWNLOAD",
+    VideoStatus.UPDATED: "UPDATE",
+    VideoStatus.PARTIAL: "RESUME",
+}
+
+
+def mirror_ftp_directory(ftp_client: ftplib.FTP) -> bool:
+    """Applies the pending catalog rows to LOCAL_DIR.
+
+    Returns False when a delete or a transfer failed, so the cycle is not
+    recorded as complete.
+    """
     cur.execute(
-        "SELECT * FROM videos WHERE video_status = ? or video_status = ? or video_status = ? ORDER BY video_id ASC",
-        (VideoStatus.NOT_DOWNLOADED, VideoStatus.DELETED, VideoStatus.UPDATED),
+        "SELECT * FROM videos WHERE video_status = ? or video_status = ? or video_status = ? or video_status = ? ORDER BY video_id ASC",
+        (
+            VideoStatus.NOT_DOWNLOADED,
+            VideoStatus.DELETED,
+            VideoStatus.UPDATED,
+            VideoStatus.PARTIAL,
+        ),
     )
     rows: list[sqlite3.Row] = cur.fetchall()
     total_files = len(rows)
     count = 1
+    failed = False
     # Delete files in local
     for row in rows:
         if row["video_status"] == VideoStatus.DELETED:
-            local_path = os.path.join(LOCAL_DIR, row["video_id"])
+            local_path = local_path_for(row["video_id"])
             try:
-                os.remove(local_path)
+                try:
+                    os.remove(local_path)
+                except FileNotFoundError:
+                    pass  # Never published, e.g. an interrupted transfer
                 print(f"[{count}/{total_files}] DELETE: {local_path}")
                 cur.execute("DELETE FROM videos WHERE video_id = ?", (row["video_id"],))
                 conn.commit()
                 count += 1
             except OSError as e:
                 logging.error(f"Error deleting file {local_path}: {e}")
+                failed = True
+    # Staged files of rows that changed or disappeared since
+    remove_stale_staging()
+
+    def start_download(row: sqlite3.Row):
+        # From here on the local file is a prefix of the remote file, or
+        # has its completed segments recorded, so an interrupted transfer
+        # is resumed next cycle
+        cur.execute(
+            "UPDATE videos SET video_status = ? WHERE video_id = ?",
+            (VideoStatus.PARTIAL, row["video_id"]),
+        )
+        conn.commit()
+
+    def finish_download(row: sqlite3.Row):
+        cur.execute(
+            "UPDATE videos SET video_status = ?, video_local_mtime = ? WHERE video_id = ?",
+            (VideoStatus.DOWNLOADED, publish_download(row), row["video_id"]),
+        )
+        cur.execute("DELETE FROM segments WHERE video_id = ?", (row["video_id"],))
+        conn.commit()
 
-    def callback(block):
+    def progress(total_bytes):
         # Print total bytes downloaded
-        nonlocal total_bytes
-        total_bytes += len(block)
-        local_file.write(block)
         sys.stdout.write(
-            f"\r[{count}/{total_files}] {"DOWNLOAD" if row['video_status'] == VideoStatus.NOT_DOWNLOADED else "UPDATE"}: {remote_path} -----> {local_path} ---- {total_bytes / 1024 / 1024 / 1024:.2f} GB"
+            f"\r[{count}/{total_files}] {DOWNLOAD_ACTIONS[row['video_status']]}: {remote_path} -----> {local_path} ---- {total_bytes / 1024 / 1024 / 1024:.2f} GB"
         )
         sys.stdout.flush()
 
-    # Download or update files
+    # Segments of files that are no longer being resumed
+    cur.execute(
+        "DELETE FROM segments WHERE video_id NOT IN (SELECT video_id FROM videos WHERE video_status = ?)",
+        (VideoStatus.PARTIAL,),
+    )
+    conn.commit()
+
+    # Download, update or resume files, large ones first in segments
+    download_rows = []
     for row in rows:
-        if (
-            row["video_status"] == VideoStatus.NOT_DOWNLOADED
-            or row["video_status"] == VideoStatus.UPDATED
-        ):
+        if row["video_status"] not in DOWNLOAD_ACTIONS:
+            continue
+        if not use_segments(row):
+            download_rows.append(row)
+            continue
+        remote_path = os.path.join(REMOTE_DIR, row["video_id"])
+        local_path = local_path_for(row["video_id"])
+        try:
+            start_download(row)
+            download_segments(row, progress)
+            finish_download(row)
+            sys.stdout.write(" DONE")
+            sys.stdout.write("\n")
+            count += 1
+        except ftplib.all_errors as e:
+            logging.error(f"Error downloading file {remote_path}: {e}")
+            failed = True
+
+    if DOWNLOAD_CONNECTIONS <= 1:
+        for row in download_rows:
             remote_path = os.path.join(REMOTE_DIR, row["video_id"])
-            local_path = os.path.join(LOCAL_DIR, row["video_id"])
+            local_path = local_path_for(row["video_id"])
             try:
-                total_bytes = 0
-                with open(local_path, "wb") as local_file:
-                    ftp_client.retrbinary(
-                        f"RETR {row["video_id"]}",
-                        callback=callback,
-                    )
-                cur.execute(
-                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
-                    (VideoStatus.DOWNLOADED, row["video_id"]),
-                )
-                conn.commit()
+                start_download(row)
+                download_file(ftp_client, row, progress)
+                finish_download(row)
                 sys.stdout.write(" DONE")
                 sys.stdout.write("\n")
                 count += 1
             except ftplib.all_errors as e:
                 logging.error(f"Error downloading file {remote_path}: {e}")
+                failed = True
+        return not failed
+
+    # Catalog updates stay on this thread; workers only transfer files
+    pool = FTPPool()
+
+    if ENGINE == "asyncio":
+        download_worker = AsyncFTP.download
+    else:
+
+        def download_worker(row: sqlite3.Row) -> sqlite3.Row:
+            with pool.connection() as worker_client:
+                download_file(worker_client, row, lambda total_bytes: None)
+            return row
+
+    queued = deque(download_rows)
+    pending = {}
+    with pool, transfer_executor(DOWNLOAD_CONNECTIONS) as executor:
+        while queued or pending:
+            # Only rows being transferred are marked PARTIAL
+            while queued and len(pending) < DOWNLOAD_CONNECTIONS:
+                row = queued.popleft()
+                start_download(row)
+                pending[executor.submit(download_worker, row)] = row
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = pending.pop(future)
+                remote_path = os.path.join(REMOTE_DIR, row["video_id"])
+                try:
+                    future.result()
+                    finish_download(row)
+                    print(
+                        f"[{count}/{total_files}] {DOWNLOAD_ACTIONS[row['video_status']]}: {remote_path} -----> {local_path_for(row['video_id'])} DONE"
+                    )
+                    count += 1
+                except ftplib.all_errors as e:
+                    logging.error(f"Error downloading file {remote_path}: {e}")
+                    failed = True
+    return not failed
 
 
 if __name__ == "__main__":
@@ -244,14 +2801,7 @@ if __name__ == "__main__":
         conn = sqlite3.connect("database/qlps.db")
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        create_table = """
-            CREATE TABLE IF NOT EXISTS videos (
-                video_id STRING PRIMARY KEY,
-                video_status INTEGER,
-                video_remote_size INTEGER                
-            );
-        """
-        cur.execute(create_table)
+        create_tables()
         conn.commit()
 
     except Exception as e:
@@ -261,24 +2811,23 @@ if __name__ == "__main__":
     if not os.path.exists("config.json"):
         # Create a template config file
         with open("config.json", "w") as f:
-            f.write(
-                "{\n"
-                ' "FTP_HOST": "127.0.0.1",\n'
-                ' "FTP_PORT": 21,\n'
-                ' "FTP_USER": "anonymous",\n'
-                ' "FTP_PASSWORD": "anonymous",\n'
-                ' "REMOTE_DIR": "MXF",\n'
-                ' "LOCAL_DIR": "D:\\\\TestFolder",\n'
-                ' "PREVIEW_MODE": true,\n'
-                ' "INTERVAL_TIME": 120\n'
-                "}"
-            )
+            template = {
+                "FTP_HOST": "127.0.0.1",
+                "FTP_PORT": 21,
+                "FTP_USER": "anonymous",
+                "FTP_PASSWORD": "anonymous",
+                "REMOTE_DIR": "MXF",
+                "LOCAL_DIR": "D:\\TestFolder",
+                "PREVIEW_MODE": True,
+                **CONFIG_DEFAULTS,
+            }
+            f.write(json.dumps(template, indent=1))
         print("Created config.json template. Please edit and run again.")
         os.system("pause")
         sys.exit(0)
 
     with open("config.json") as f:
-        config = json.load(f)
+        config = {**CONFIG_DEFAULTS, **json.load(f)}
 
     FTP_HOST = config["FTP_HOST"]
     FTP_PORT = config["FTP_PORT"]
@@ -288,6 +2837,38 @@ if __name__ == "__main__":
     LOCAL_DIR = os.path.normpath(config["LOCAL_DIR"])
     PREVIEW_MODE = config["PREVIEW_MODE"]
     INTERVAL_TIME = config["INTERVAL_TIME"]
+    PROBE_CONNECTIONS = config["PROBE_CONNECTIONS"]
+    PIPELINE_WINDOW = config["PIPELINE_WINDOW"]
+    RECONCILE_MODE = config["RECONCILE_MODE"]
+    INCREMENTAL_SCAN = config["INCREMENTAL_SCAN"]
+    SKIP_UNCHANGED_SCANS = config["SKIP_UNCHANGED_SCANS"]
+    STAT_LISTING = config["STAT_LISTING"]
+    RECURSIVE = config["RECURSIVE"]
+    WALK_CONNECTIONS = config["WALK_CONNECTIONS"]
+    DIR_CACHE_MAX_AGE = config["DIR_CACHE_MAX_AGE"]
+    ADAPTIVE_POLLING = config["ADAPTIVE_POLLING"]
+    POLL_MIN_INTERVAL = config["POLL_MIN_INTERVAL"]
+    POLL_MAX_INTERVAL = config["POLL_MAX_INTERVAL"]
+    LOCAL_WATCH = config["LOCAL_WATCH"]
+    VERIFY_LOCAL_MTIME = config["VERIFY_LOCAL_MTIME"]
+    RESUME_OVERLAP = config["RESUME_OVERLAP"]
+    DOWNLOAD_CONNECTIONS = config["DOWNLOAD_CONNECTIONS"]
+    SEGMENT_CONNECTIONS = config["SEGMENT_CONNECTIONS"]
+    SEGMENT_SIZE = config["SEGMENT_SIZE"]
+    ENGINE = config["ENGINE"]
+    WRITE_BEHIND_BUFFERS = config["WRITE_BEHIND_BUFFERS"]
+    RECV_BLOCK_SIZE = config["RECV_BLOCK_SIZE"]
+    ZERO_COPY = config["ZERO_COPY"]
+    PREALLOCATE = config["PREALLOCATE"]
+    DROP_CACHE = config["DROP_CACHE"]
+    DIRECT_IO = config["DIRECT_IO"]
+
+    local_index = None
+    if LOCAL_WATCH:
+        try:
+            local_index = LocalIndex()
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Local watch unavailable, walking every cycle: {e}")
 
     print(f"Connecting to FTP {FTP_HOST}:{FTP_PORT}")
     print(f"Watch remote folder {REMOTE_DIR}")
@@ -298,27 +2879,32 @@ if __name__ == "__main__":
     try:
         while True:
             ftp = None
+            completed = True
             try:
-                ftp = ftplib.FTP()
-                ftp.connect(FTP_HOST, FTP_PORT)
-                ftp.login(FTP_USER, FTP_PASSWORD)
-                ftp.cwd(REMOTE_DIR)
+                ftp = connect_ftp()
                 if PREVIEW_MODE:
                     print("Logged in to FTP server successfully.")
-                ftp.set_pasv(True)
 
-                scan_remote(ftp, REMOTE_DIR)
-                scan_local()
-                preview_changes()
+                local_files = local_snapshot()
+                fingerprint = scan_remote(ftp, REMOTE_DIR, local_files)
+                if remote_unchanged(fingerprint):
+                    if PREVIEW_MODE:
+                        print("No changes detected")
+                        break
+                else:
+                    scan_local(local_files)
+                    preview_changes()
 
-                if PREVIEW_MODE:
-                    action = input("Do you want to commit?[Y/n] ")
-                    if action.lower() != "y":
-                        sys.exit(0)
+                    if PREVIEW_MODE:
+                        action = input("Do you want to commit?[Y/n] ")
+                        if action.lower() != "y":
+                            sys.exit(0)
 
-                mirror_ftp_directory(ftp)
-                if PREVIEW_MODE:
-                    break
+                    completed = mirror_ftp_directory(ftp)
+                    if completed and fingerprint is not None:
+                        set_sync_state("remote_fingerprint", fingerprint)
+                    if PREVIEW_MODE:
+                        break
             except ftplib.all_errors as e:
                 logging.error(f"FTP Error: {e}")
                 break
@@ -327,9 +2913,9 @@ if __name__ == "__main__":
                     ftp.quit()
                     if PREVIEW_MODE:
                         print("Disconnected from FTP server.")
-                conn.close()
-            time.sleep(INTERVAL_TIME)
+            time.sleep(next_cycle_delay(completed))
     except KeyboardInterrupt:
         print("Program interrupted by user. Exiting...")
     finally:
+        conn.close()
         os.system("pause")
@@ -0,0 +1,86 @@
+"""Shared setup for the tests: main's config globals, an in-memory catalog
+and a local FTP server (needs pyftpdlib)."""
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import main
+from main import CONFIG_DEFAULTS
+
+
+def configure(**settings):
+    """Sets main's config globals, which main only sets when run as a
+    script, to CONFIG_DEFAULTS overridden by settings. PREVIEW_MODE, which
+    has no default, is off unless given."""
+    for name, value in {**CONFIG_DEFAULTS, "PREVIEW_MODE": False, **settings}.items():
+        setattr(main, name, value)
+
+
+def open_catalog() -> sqlite3.Connection:
+    """Points main at a fresh in-memory database with the catalog tables."""
+    main.conn = sqlite3.connect(":memory:")
+    main.conn.row_factory = sqlite3.Row
+    main.cur = main.conn.cursor()
+    main.create_tables()
+    main.conn.commit()
+    return main.conn
+
+
+def catalog_state(conn: sqlite3.Connection) -> list[tuple]:
+    """The (video_id, video_status, video_remote_size) rows, sorted."""
+    return [
+        tuple(row)
+        for row in conn.execute(
+            "SELECT video_id, video_status, video_remote_size FROM videos ORDER BY video_id"
+        )
+    ]
+
+
+def make_handler(root: str, disabled: tuple[str, ...] = (), rate: int = 0):
+    """FTPHandler subclass serving root, without the given commands and
+    throttled to rate bytes/s on the data connection when rate > 0."""
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    attributes = {
+        "authorizer": authorizer,
+        "proto_cmds": {
+            name: value
+            for name, value in FTPHandler.proto_cmds.items()
+            if name not in disabled
+        },
+    }
+    if rate:
+        attributes["dtp_handler"] = type(
+            "Throttled", (ThrottledDTPHandler,), {"read_limit": 0, "write_limit": rate}
+        )
+        attributes["use_sendfile"] = False
+    return type("Handler", (FTPHandler,), attributes)
+
+
+@contextmanager
+def ftp_server(
+    root: str, remote_dir: str, disabled: tuple[str, ...] = (), rate: int = 0
+):
+    """Serves root with pyftpdlib from a background thread and points main's
+    FTP_* settings at it, with remote_dir as REMOTE_DIR."""
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+    server = ThreadedFTPServer(("127.0.0.1", 0), make_handler(root, disabled, rate))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    main.FTP_HOST = "127.0.0.1"
+    main.FTP_PORT = server.address[1]
+    main.FTP_USER = "anonymous"
+    main.FTP_PASSWORD = "anonymous"
+    main.REMOTE_DIR = remote_dir
+    try:
+        yield server
+    finally:
+        server.close_all()
+        thread.join()
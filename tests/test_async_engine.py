@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+from main import VideoStatus
+from tests.support import configure, ftp_server, open_catalog
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class AsyncEngineTest(unittest.TestCase):
+    """Mirrors a local pyftpdlib server with ENGINE = "asyncio"."""
+
+    def setUp(self):
+        remote_root = tempfile.TemporaryDirectory()
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(remote_root.cleanup)
+        self.addCleanup(local_dir.cleanup)
+        self.remote_dir = os.path.join(remote_root.name, "MXF")
+        self.local_dir = local_dir.name
+        os.mkdir(self.remote_dir)
+        self.rng = random.Random(20)
+        main.local_index = None
+        self.addCleanup(open_catalog().close)
+        server = ftp_server(remote_root.name, "MXF")
+        server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+
+        # Disk writes must happen on worker threads, not on the event loop
+        self.writes_on_loop = 0
+        write_at, resume_write = main.write_at, main.ResumeFile.write
+
+        def checked_write_at(*args):
+            self.writes_on_loop += on_event_loop()
+            return write_at(*args)
+
+        def checked_resume_write(*args):
+            self.writes_on_loop += on_event_loop()
+            return resume_write(*args)
+
+        for patch in (
+            mock.patch.object(main, "write_at", checked_write_at),
+            mock.patch.object(main.ResumeFile, "write", checked_resume_write),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def add_remote_file(self, name: str, size: int) -> bytes:
+        path = os.path.join(self.remote_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = self.rng.randbytes(size)
+        with open(path, "wb") as f:
+            f.write(data)
+        return data
+
+    def sync(self):
+        ftp = main.connect_ftp()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                local_files = main.local_snapshot()
+                main.scan_remote(ftp, main.REMOTE_DIR, local_files)
+                main.scan_local(local_files)
+                self.assertTrue(main.mirror_ftp_directory(ftp))
+        finally:
+            ftp.quit()
+
+    def assert_mirrored(self, files: dict[str, bytes]):
+        for name, data in files.items():
+            with open(os.path.join(self.local_dir, name), "rb") as f:
+                self.assertEqual(f.read(), data, name)
+        statuses = {
+            row["video_id"]: row["video_status"]
+            for row in main.conn.execute("SELECT video_id, video_status FROM videos")
+        }
+        self.assertEqual(statuses, dict.fromkeys(files, VideoStatus.DOWNLOADED))
+        self.assertEqual(self.writes_on_loop, 0)
+
+    def test_parallel_downloads_of_a_tree(self):
+        configure(
+            LOCAL_DIR=self.local_dir,
+            ENGINE="asyncio",
+            RECURSIVE=True,
+            WALK_CONNECTIONS=3,
+            DOWNLOAD_CONNECTIONS=3,
+        )
+        files = {
+            f"{folder}/f{i}.mxf": self.add_remote_file(
+                f"{folder}/f{i}.mxf", self.rng.randrange(300_000)
+            )
+            for folder in ("2024/01", "2024/02", "2025")
+            for i in range(4)
+        }
+        self.sync()
+        self.assert_mirrored(files)
+
+        # A changed file and a truncated local copy
+        files["2025/f0.mxf"] = self.add_remote_file("2025/f0.mxf", 200_000)
+        with open(os.path.join(self.local_dir, "2024/01/f1.mxf"), "r+b") as f:
+            f.truncate(1000)
+        self.sync()
+        self.assert_mirrored(files)
+
+    def test_segmented_download(self):
+        configure(
+            LOCAL_DIR=self.local_dir,
+            ENGINE="asyncio",
+            SEGMENT_CONNECTIONS=3,
+            SEGMENT_SIZE=100_000,
+            RESUME_OVERLAP=0,
+        )
+        files = {"big.mxf": self.add_remote_file("big.mxf", 1_050_000)}
+        self.sync()
+        self.assert_mirrored(files)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import ftplib
+import unittest
+from unittest import mock
+from datetime import datetime
+
+import main
+from main import RemoteEntry, parse_list_line, parse_mlsd_line, stat_listing
+from tests.support import configure, open_catalog
+
+
+class StatReplyClient:
+    """Answers every command with one reply, raising it like ftplib does."""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+
+    def sendcmd(self, command: str) -> str:
+        if self.reply[0] == "4":
+            raise ftplib.error_temp(self.reply)
+        if self.reply[0] == "5":
+            raise ftplib.error_perm(self.reply)
+        return self.reply
+
+
+class ParseListingTest(unittest.TestCase):
+    def test_mlsd_modify_has_seconds(self):
+        self.assertEqual(
+            parse_mlsd_line("type=file;size=1024;modify=20240101120059.123; a.mxf"),
+            RemoteEntry("a.mxf", 1024, "20240101120059", "file"),
+        )
+
+    def test_recent_list_entry_has_minutes(self):
+        entry = parse_list_line("-rw-r--r-- 1 ftp ftp 1024 Jan 01 12:00 a.mxf")
+        self.assertEqual(len(entry.modify), 12)
+        self.assertEqual(entry.modify[4:], "01011200")
+        self.assertLessEqual(entry.modify[:4], str(datetime.now().year))
+
+    def test_old_list_entries(self):
+        self.assertEqual(
+            parse_list_line("-rw-r--r-- 1 ftp ftp 1024 Jan 01 2020 a.mxf"),
+            RemoteEntry("a.mxf", 1024, None, "file"),
+        )
+        self.assertEqual(
+            parse_list_line("drwxr-xr-x 2 ftp ftp 4096 Jan 01 2020 2020"),
+            RemoteEntry("2020", 4096, "20200101", "dir"),
+        )
+
+    def test_impossible_dates_are_skipped(self):
+        for line in (
+            "-rw-r--r-- 1 ftp ftp 1024 Jan 32 12:00 a.mxf",
+            "-rw-r--r-- 1 ftp ftp 1024 Jan 01 25:00 a.mxf",
+            "-rw-r--r-- 1 ftp ftp 1024 Jan 01 12:xx a.mxf",
+            "drwxr-xr-x 2 ftp ftp 4096 Feb 29 2023 2023",
+            "drwxr-xr-x 2 ftp ftp 4096 Jan 01 20x4 2024",
+        ):
+            self.assertIsNone(parse_list_line(line), line)
+        with mock.patch.object(main, "datetime") as clock:
+            clock.now.return_value = datetime(2025, 6, 1)
+            clock.side_effect = datetime
+            self.assertIsNone(
+                parse_list_line("-rw-r--r-- 1 ftp ftp 1024 Feb 29 12:00 a.mxf")
+            )
+
+    def test_dot_entries_are_skipped(self):
+        for line in (
+            "drwxr-xr-x 2 ftp ftp 4096 Jan 01 12:00 .",
+            "drwxr-xr-x 2 ftp ftp 4096 Jan 01 12:00 ..",
+            "01-15-24  03:45PM       <DIR>          ..",
+        ):
+            self.assertIsNone(parse_list_line(line), line)
+
+    def test_dos_list_entry_has_minutes(self):
+        self.assertEqual(
+            parse_list_line("01-15-24  03:45PM            1024 a.mxf"),
+            RemoteEntry("a.mxf", 1024, "202401151545", "file"),
+        )
+
+
+class StatTreeClient:
+    """Answers STAT <dir> like vsftpd, with "." and ".." in every listing."""
+
+    def __init__(self, tree: dict[str, list[str]]):
+        self.tree = tree
+
+    def sendcmd(self, command: str) -> str:
+        path = command.partition(" ")[2]
+        lines = [
+            "drwxr-xr-x 2 ftp ftp 4096 Jan 01 12:00 .",
+            "drwxr-xr-x 2 ftp ftp 4096 Jan 01 12:00 ..",
+        ]
+        for name in self.tree[path]:
+            if name.endswith("/"):
+                lines.append(f"drwxr-xr-x 2 ftp ftp 4096 Jan 01 12:00 {name[:-1]}")
+            else:
+                lines.append(f"-rw-r--r-- 1 ftp ftp 1024 Jan 01 12:00 {name}")
+        return "213-Status of {path}:\n{}\n213 End of status".format(
+            "\n".join(f" {line}" for line in lines), path=path
+        )
+
+
+class StatListingTest(unittest.TestCase):
+    def test_listing_reply(self):
+        client = StatReplyClient(
+            "213-Status of MXF:\n"
+            " -rw-r--r-- 1 ftp ftp 1024 Jan 01 12:00 a.mxf\n"
+            "213 End of status"
+        )
+        (entry,) = stat_listing(client, "MXF")
+        self.assertEqual((entry.name, entry.size), ("a.mxf", 1024))
+
+    def test_unsupported_replies(self):
+        for reply in (
+            "502 Command not implemented",
+            "501 Syntax error",
+            "211-FTP server status:\n Connected\n211 End of status",
+        ):
+            self.assertIsNone(stat_listing(StatReplyClient(reply), "MXF"), reply)
+
+    def test_directory_errors_are_raised(self):
+        for reply in ("550 No such directory", "450 Directory busy"):
+            with self.assertRaises(ftplib.Error, msg=reply):
+                stat_listing(StatReplyClient(reply), "MXF")
+
+
+class WalkRemoteTreeTest(unittest.TestCase):
+    def setUp(self):
+        configure(STAT_LISTING=True, RECURSIVE=True, WALK_CONNECTIONS=1)
+        main.stat_listing_supported = None
+        self.addCleanup(open_catalog().close)
+
+    def walk(self, client) -> list[str]:
+        return sorted(entry.name for entry in main.walk_remote_tree(client))
+
+    def test_dot_entries_are_not_walked(self):
+        client = StatTreeClient({".": ["2024/", "a.mxf"], "2024": ["b.mxf"]})
+        self.assertEqual(self.walk(client), ["2024", "2024/b.mxf", "a.mxf"])
+
+    def test_names_with_a_slash_are_skipped(self):
+        entries = [
+            RemoteEntry("..", None, None, "dir"),
+            RemoteEntry("../a.mxf", 1024, None, "file"),
+            RemoteEntry("", 1024, None, "file"),
+            RemoteEntry("b.mxf", 1024, None, "file"),
+        ]
+        with mock.patch.object(
+            main, "iter_remote_listing", lambda client, path: iter(entries)
+        ):
+            self.assertEqual(self.walk(None), ["b.mxf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
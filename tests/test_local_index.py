@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import main
+from tests.support import configure, open_catalog
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class LocalIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.local_dir.cleanup)
+        configure(LOCAL_DIR=self.local_dir.name, LOCAL_WATCH=True)
+        self.addCleanup(open_catalog().close)
+        self.index = main.LocalIndex()
+        self.addCleanup(os.close, self.index.fd)
+
+    def write(self, name: str, data: bytes):
+        with open(os.path.join(self.local_dir.name, name), "wb") as f:
+            f.write(data)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition(self.index.snapshot()):
+            self.assertLess(time.monotonic(), deadline, "inotify event not seen")
+            time.sleep(0.01)
+
+    def test_snapshot_follows_changes(self):
+        self.write("a.mxf", b"a")
+        self.assertEqual(self.index.snapshot()["a.mxf"].size, 1)
+        self.write("a.mxf", b"abc")
+        self.write("b.mxf", b"b")
+        self.wait_for(lambda files: files.get("a.mxf", (0,))[0] == 3)
+        self.wait_for(lambda files: "b.mxf" in files)
+        os.remove(os.path.join(self.local_dir.name, "a.mxf"))
+        self.wait_for(lambda files: "a.mxf" not in files)
+
+    def test_catalog_has_no_local_index_table(self):
+        tables = {row[0] for row in main.conn.execute("SELECT name FROM sqlite_master")}
+        self.assertNotIn("local_index", tables)
+
+
+if __name__ == "__main__":
+    unittest.main()
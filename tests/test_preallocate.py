@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+from tests.support import configure, ftp_server
+
+SIZE = 8 * 1024 * 1024
+
+
+def allocated(path: str) -> int:
+    return os.stat(path).st_blocks * 512
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "fallocate is Linux only")
+class PreallocateTest(unittest.TestCase):
+    def setUp(self):
+        remote_root = tempfile.TemporaryDirectory()
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(remote_root.cleanup)
+        self.addCleanup(local_dir.cleanup)
+        os.mkdir(os.path.join(remote_root.name, "MXF"))
+        self.data = os.urandom(SIZE)
+        with open(os.path.join(remote_root.name, "MXF", "a.mxf"), "wb") as f:
+            f.write(self.data)
+        self.local_path = os.path.join(local_dir.name, "a.mxf")
+        configure(PREALLOCATE=True)
+
+        probe = os.path.join(local_dir.name, "probe")
+        with open(probe, "wb") as f:
+            main.preallocate(f.fileno(), 0, SIZE)
+        if allocated(probe) < SIZE:
+            self.skipTest("filesystem does not support fallocate")
+        os.remove(probe)
+
+        server = ftp_server(remote_root.name, "MXF")
+        server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+
+    def download(self, offset: int = 0) -> int:
+        """Returns the bytes allocated to the file at its first write."""
+        allocated_at_first_write = []
+        write = main.ResumeFile.write
+
+        def checked_write(resume, *args):
+            if not allocated_at_first_write:
+                allocated_at_first_write.append(allocated(resume.local_path))
+            return write(resume, *args)
+
+        ftp = main.connect_ftp()
+        with mock.patch.object(main.ResumeFile, "write", checked_write):
+            main.retrieve_file(
+                ftp, "a.mxf", self.local_path, offset, lambda size: None, SIZE
+            )
+        ftp.quit()
+        with open(self.local_path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        return allocated_at_first_write[0]
+
+    def test_new_file(self):
+        self.assertGreaterEqual(self.download(), SIZE)
+
+    def test_direct_io(self):
+        configure(PREALLOCATE=True, DIRECT_IO=True)
+        self.assertGreaterEqual(self.download(), SIZE)
+
+    def test_resume(self):
+        with open(self.local_path, "wb") as f:
+            f.write(self.data[: SIZE // 2])
+        self.assertGreaterEqual(self.download(SIZE // 2), SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
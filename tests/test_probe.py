@@ -0,0 +1,102 @@
+import socket
+import threading
+import unittest
+from unittest import mock
+
+import main
+from tests.support import configure
+
+SIZES = {f"f{i}.mxf": 1000 + i for i in range(20)}
+
+
+class ProbeServer:
+    """A minimal FTP server for SIZE probing.
+
+    With answer_queued False it answers only the first command of each
+    write and drops the rest, like servers that do not tolerate pipelining.
+    """
+
+    def __init__(self, answer_queued: bool):
+        self.answer_queued = answer_queued
+        self.connections = 0
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def reply(self, command: str) -> str:
+        verb, _, argument = command.partition(" ")
+        if verb == "SIZE":
+            if argument in SIZES:
+                return f"213 {SIZES[argument]}"
+            return "550 No such file"
+        return {
+            "USER": "331 Password required",
+            "PASS": "230 Logged in",
+            "CWD": "250 OK",
+            "TYPE": "200 OK",
+            "QUIT": "221 Bye",
+        }.get(verb, "502 Not implemented")
+
+    def serve(self, sock: socket.socket):
+        with sock:
+            sock.sendall(b"220 Ready\r\n")
+            while data := sock.recv(65536):
+                commands = data.decode().splitlines()
+                if not self.answer_queued:
+                    commands = commands[:1]
+                replies = [self.reply(command) for command in commands]
+                sock.sendall("".join(f"{reply}\r\n" for reply in replies).encode())
+                if "221 Bye" in replies:
+                    return
+
+
+class PipelinedProbeTest(unittest.TestCase):
+    def setUp(self):
+        configure(PIPELINE_WINDOW=8)
+        main.pipelining_tolerated = None
+        patch = mock.patch.object(main, "PIPELINE_REPLY_TIMEOUT", 0.2)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def probe(self, server: ProbeServer) -> dict[str, int | None]:
+        main.FTP_HOST = "127.0.0.1"
+        main.FTP_PORT = server.port
+        main.FTP_USER = main.FTP_PASSWORD = "anonymous"
+        main.REMOTE_DIR = "MXF"
+        ftp = main.connect_ftp()
+        entries = main.probe_files(ftp, [*SIZES, "gone.mxf"])
+        ftp.quit()
+        return {entry.name: entry.size for entry in entries}
+
+    def test_tolerant_server(self):
+        server = ProbeServer(answer_queued=True)
+        self.addCleanup(server.close)
+        self.assertEqual(self.probe(server), {**SIZES, "gone.mxf": None})
+        self.assertIs(main.pipelining_tolerated, True)
+        self.assertEqual(server.connections, 1)
+
+    def test_server_dropping_queued_commands(self):
+        server = ProbeServer(answer_queued=False)
+        self.addCleanup(server.close)
+        with self.assertLogs(level="WARNING"):
+            sizes = self.probe(server)
+        self.assertEqual(sizes, {**SIZES, "gone.mxf": None})
+        self.assertIs(main.pipelining_tolerated, False)
+        # Reconnected once, since the dropped replies desync the first one
+        self.assertEqual(server.connections, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+import random
+import unittest
+
+import main
+from main import RemoteEntry, VideoStatus
+from tests.support import catalog_state, configure, open_catalog
+
+IDS = [f"f{i:02d}.mxf" for i in range(30)]
+
+
+def reconcile_row_by_row(conn, remote_files: dict[str, RemoteEntry], local: set):
+    """The scan_remote loop diff_catalog replaced, one query per row."""
+    cur = conn.cursor()
+    for row in cur.execute("SELECT * FROM videos").fetchall():
+        video_id, status = row["video_id"], row["video_status"]
+        if video_id not in remote_files:
+            if status in (VideoStatus.DOWNLOADED, VideoStatus.UPDATED):
+                cur.execute(
+                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
+                    (VideoStatus.DELETED, video_id),
+                )
+            elif status == VideoStatus.NOT_DOWNLOADED or (
+                status == VideoStatus.DELETED and video_id not in local
+            ):
+                cur.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+            elif status == VideoStatus.DELETED:
+                cur.execute(
+                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
+                    (VideoStatus.UPDATED, video_id),
+                )
+        elif video_id in local:
+            if status in (VideoStatus.DELETED, VideoStatus.NOT_DOWNLOADED):
+                cur.execute(
+                    "UPDATE videos SET video_status = ? WHERE video_id = ?",
+                    (VideoStatus.UPDATED, video_id),
+                )
+        elif status == VideoStatus.DELETED:
+            cur.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+
+    for video_id, entry in remote_files.items():
+        if entry.size is None:
+            continue
+        row = cur.execute(
+            "SELECT * FROM videos WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if row is None:
+            cur.execute(
+                "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES (?, ?, ?)",
+                (video_id, VideoStatus.NOT_DOWNLOADED, entry.size),
+            )
+        elif entry.size != row["video_remote_size"]:
+            cur.execute(
+                "UPDATE videos SET video_status = ?, video_remote_size = ? WHERE video_id = ?",
+                (VideoStatus.UPDATED, entry.size, video_id),
+            )
+    conn.commit()
+
+
+def reconcile_with_diff(conn, remote_files: dict[str, RemoteEntry], local: set):
+    main.conn, main.cur = conn, conn.cursor()
+    catalog = {
+        row["video_id"]: (
+            row["video_status"],
+            row["video_remote_size"],
+            row["video_remote_mtime"],
+        )
+        for row in conn.execute("SELECT * FROM videos")
+    }
+    main.apply_transitions(main.diff_catalog(remote_files, local, catalog))
+
+
+def reconcile_with_sql(conn, remote_files: dict[str, RemoteEntry], local: set):
+    main.conn, main.cur = conn, conn.cursor()
+    main.stage_remote_listing(remote_files.values())
+    main.reconcile_in_sql(local)
+
+
+def full_state(conn) -> list[tuple]:
+    return [
+        tuple(row)
+        for row in conn.execute(
+            "SELECT video_id, video_status, video_remote_size, video_remote_mtime FROM videos ORDER BY video_id"
+        )
+    ]
+
+
+def random_scan(rng: random.Random) -> tuple[dict[str, RemoteEntry], set]:
+    """A listing with sizes 1, 2 or unknown, and a local folder, over IDS."""
+    remote_files = {
+        video_id: RemoteEntry(video_id, rng.choice([1, 2, None]), None, "file")
+        for video_id in rng.sample(IDS, 15)
+    }
+    return remote_files, set(rng.sample(IDS, 15))
+
+
+def random_catalog(rng: random.Random) -> list[tuple]:
+    """Rows in the statuses that existed before PARTIAL."""
+    return [
+        (video_id, rng.choice(range(4)), rng.choice([1, 2]))
+        for video_id in rng.sample(IDS, 15)
+    ]
+
+
+# MLSD/MDTM seconds, LIST minutes with guessed years, and LIST dates
+MTIMES = [
+    None,
+    "20240101120000",
+    "20240102120000",
+    "202401011200",
+    "202501011200",
+    "202401021200",
+    "20240101",
+]
+
+
+def random_dated_scan(rng: random.Random) -> tuple[dict[str, RemoteEntry], set]:
+    """Like random_scan, with modify times."""
+    remote_files = {
+        video_id: RemoteEntry(
+            video_id, rng.choice([1, 2, None]), rng.choice(MTIMES), "file"
+        )
+        for video_id in rng.sample(IDS, 15)
+    }
+    return remote_files, set(rng.sample(IDS, 15))
+
+
+def random_dated_catalog(rng: random.Random) -> list[tuple]:
+    """Rows in any status, with unknown sizes and modify times."""
+    return [
+        (
+            video_id,
+            rng.choice(range(5)),
+            rng.choice([1, 2, None]),
+            rng.choice(MTIMES),
+        )
+        for video_id in rng.sample(IDS, 15)
+    ]
+
+
+def catalog_with(rows: list[tuple]):
+    conn = open_catalog()
+    conn.executemany(
+        "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES (?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    return conn
+
+
+class DiffCatalogTest(unittest.TestCase):
+    def setUp(self):
+        configure()
+
+    def test_matches_row_by_row_reconcile(self):
+        rng = random.Random(4)
+        for trial in range(300):
+            rows = random_catalog(rng)
+            remote_files, local = random_scan(rng)
+            expected, actual = catalog_with(rows), catalog_with(rows)
+            reconcile_row_by_row(expected, remote_files, local)
+            reconcile_with_diff(actual, remote_files, local)
+            self.assertEqual(
+                catalog_state(expected), catalog_state(actual), f"trial {trial}"
+            )
+            expected.close()
+            actual.close()
+
+
+class ModifyPrecisionTest(unittest.TestCase):
+    def setUp(self):
+        configure()
+
+    def scan(self, catalog_mtime: str, listed_modify: str) -> tuple:
+        conn = catalog_with([("a.mxf", VideoStatus.DOWNLOADED, 1)])
+        conn.execute("UPDATE videos SET video_remote_mtime = ?", (catalog_mtime,))
+        reconcile_with_diff(
+            conn, {"a.mxf": RemoteEntry("a.mxf", 1, listed_modify, "file")}, {"a.mxf"}
+        )
+        (row,) = full_state(conn)
+        conn.close()
+        return row[1], row[3]
+
+    def test_list_time_in_another_guessed_year_is_unchanged(self):
+        self.assertEqual(
+            self.scan("202501011200", "202401011200"),
+            (VideoStatus.DOWNLOADED, "202501011200"),
+        )
+
+    def test_list_time_change_marks_updated(self):
+        self.assertEqual(
+            self.scan("202401011200", "202401011201"),
+            (VideoStatus.UPDATED, "202401011201"),
+        )
+
+    def test_other_listing_source_refreshes_mtime_only(self):
+        self.assertEqual(
+            self.scan("202401011200", "20240101120059"),
+            (VideoStatus.DOWNLOADED, "20240101120059"),
+        )
+        self.assertEqual(
+            self.scan("20240101120059", "202401011200"),
+            (VideoStatus.DOWNLOADED, "202401011200"),
+        )
+
+
+class ReconcileInSqlTest(unittest.TestCase):
+    def setUp(self):
+        configure(RECONCILE_MODE="sql")
+
+    def test_matches_diff_catalog(self):
+        rng = random.Random(5)
+        for trial in range(200):
+            rows = random_dated_catalog(rng)
+            expected, actual = open_catalog(), open_catalog()
+            for conn in (expected, actual):
+                conn.executemany(
+                    "INSERT INTO videos (video_id, video_status, video_remote_size, video_remote_mtime) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.commit()
+            # Several scans in a row, so the scan generations of rows left
+            # behind by earlier scans are exercised too
+            for scan in range(3):
+                remote_files, local = random_dated_scan(rng)
+                reconcile_with_diff(expected, remote_files, local)
+                reconcile_with_sql(actual, remote_files, local)
+                self.assertEqual(
+                    full_state(expected), full_state(actual), f"trial {trial}/{scan}"
+                )
+            expected.close()
+            actual.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
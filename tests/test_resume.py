@@ -0,0 +1,79 @@
+import os
+import random
+import tempfile
+import unittest
+
+import main
+from tests.support import configure, ftp_server
+
+SIZE = 1_000_000
+OFFSET = 600_000
+OVERLAP = 65536
+
+# Receive paths of retrieve_file
+MODES = {
+    "retrbinary": {},
+    "RECV_BLOCK_SIZE": {"RECV_BLOCK_SIZE": 16384},
+    "ZERO_COPY": {"ZERO_COPY": True},
+}
+
+
+class ResumeCheckTest(unittest.TestCase):
+    """Resumes downloads from a local pyftpdlib server whose file changed."""
+
+    def setUp(self):
+        remote_root = tempfile.TemporaryDirectory()
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(remote_root.cleanup)
+        self.addCleanup(local_dir.cleanup)
+        os.mkdir(os.path.join(remote_root.name, "MXF"))
+        self.remote_path = os.path.join(remote_root.name, "MXF", "a.mxf")
+        self.local_path = os.path.join(local_dir.name, "a.mxf")
+        self.data = random.Random(17).randbytes(SIZE)
+        server = ftp_server(remote_root.name, "MXF")
+        server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+
+    def resume(self, remote: bytes, local: bytes, warning: str):
+        """Resumes local against remote in every mode, checking that the
+        whole remote file ends up downloaded again and that the control
+        connection is still in sync."""
+        with open(self.remote_path, "wb") as f:
+            f.write(remote)
+        for mode, settings in MODES.items():
+            if settings.get("ZERO_COPY") and not main.splice_supported:
+                continue
+            with self.subTest(mode):
+                configure(RESUME_OVERLAP=OVERLAP, **settings)
+                with open(self.local_path, "wb") as f:
+                    f.write(local)
+                ftp = main.connect_ftp()
+                with self.assertLogs(level="WARNING") as logs:
+                    main.retrieve_file(
+                        ftp, "a.mxf", self.local_path, len(local), lambda size: None
+                    )
+                self.assertIn(warning, logs.output[0])
+                self.assertEqual(ftp.size("a.mxf"), len(remote))
+                ftp.quit()
+                with open(self.local_path, "rb") as f:
+                    self.assertEqual(f.read(), remote)
+
+    def test_mismatch_in_overlap(self):
+        local = bytearray(self.data[:OFFSET])
+        local[OFFSET - OVERLAP // 2] ^= 0xFF
+        self.resume(self.data, bytes(local), "Resume check failed")
+
+    def test_remote_shorter_than_offset(self):
+        self.resume(
+            self.data[: OFFSET - OVERLAP // 2],
+            self.data[:OFFSET],
+            "Resume check failed",
+        )
+
+    def test_remote_shorter_than_overlap_start(self):
+        # pyftpdlib refuses REST past the end of the file
+        self.resume(self.data[: OFFSET // 2], self.data[:OFFSET], "Resume refused")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import main
+from main import VideoStatus
+from tests.support import configure, ftp_server, open_catalog
+
+DATA = bytes(range(256)) * 4000
+
+
+class StagingTest(unittest.TestCase):
+    def setUp(self):
+        remote_root = tempfile.TemporaryDirectory()
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(remote_root.cleanup)
+        self.addCleanup(local_dir.cleanup)
+        self.remote_root = remote_root.name
+        self.local_dir = local_dir.name
+        os.mkdir(os.path.join(self.remote_root, "MXF"))
+        with open(os.path.join(self.remote_root, "MXF", "a.mxf"), "wb") as f:
+            f.write(DATA)
+        configure(LOCAL_DIR=self.local_dir, PREVIEW_MODE=True)
+        main.local_index = None
+        self.conn = open_catalog()
+        self.addCleanup(self.conn.close)
+        self.conn.execute(
+            "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES ('a.mxf', ?, ?)",
+            (VideoStatus.DOWNLOADED, len(DATA)),
+        )
+
+    def write_local(self, path: str, data: bytes):
+        local_path = os.path.join(self.local_dir, path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as f:
+            f.write(data)
+
+    def status(self) -> int:
+        return self.conn.execute("SELECT video_status FROM videos").fetchone()[0]
+
+    def test_scan_leaves_the_local_tree_alone(self):
+        self.write_local("a.mxf", DATA[:1000])
+        self.write_local(".sync-staging/gone.mxf", b"stale")
+        main.scan_local(main.local_snapshot())
+        self.assertEqual(self.status(), VideoStatus.PARTIAL)
+        self.assertEqual(sorted(os.listdir(self.local_dir)), [".sync-staging", "a.mxf"])
+        self.assertEqual(os.listdir(main.local_path_for(".sync-staging")), ["gone.mxf"])
+
+    def test_truncated_copy_is_moved_to_staging_and_resumed(self):
+        self.write_local("a.mxf", DATA[:1000])
+        self.write_local(".sync-staging/gone.mxf", b"stale")
+        main.scan_local(main.local_snapshot())
+        with ftp_server(self.remote_root, "MXF"):
+            ftp = main.connect_ftp()
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(main.mirror_ftp_directory(ftp))
+            ftp.quit()
+        with open(os.path.join(self.local_dir, "a.mxf"), "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(self.status(), VideoStatus.DOWNLOADED)
+        self.assertEqual(os.listdir(main.local_path_for(".sync-staging")), [])
+
+    def test_copy_outside_local_dir_root_starts_over(self):
+        # Without RECURSIVE files are matched by name in any subfolder
+        self.write_local("sub/a.mxf", DATA[:1000])
+        main.scan_local(main.local_snapshot())
+        self.assertEqual(self.status(), VideoStatus.PARTIAL)
+        row = self.conn.execute("SELECT * FROM videos").fetchone()
+        self.assertEqual(
+            main.prepare_download(row), (main.staging_path_for("a.mxf"), 0)
+        )
+
+    def test_prepare_download_resumes_truncated_copy(self):
+        self.write_local("a.mxf", DATA[:1000])
+        main.scan_local(main.local_snapshot())
+        row = self.conn.execute("SELECT * FROM videos").fetchone()
+        self.assertEqual(
+            main.prepare_download(row), (main.staging_path_for("a.mxf"), 1000)
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, "a.mxf")))
+
+    def test_staged_files_do_not_look_like_videos(self):
+        self.write_local("2024/a.mxf", DATA[:1000])
+        self.conn.execute(
+            "UPDATE videos SET video_id = '2024/a.mxf', video_status = ?",
+            (VideoStatus.PARTIAL,),
+        )
+        row = self.conn.execute("SELECT * FROM videos").fetchone()
+        staged_path, _ = main.prepare_download(row)
+        self.assertEqual(
+            os.path.relpath(staged_path, self.local_dir),
+            os.path.join(".sync-staging", "2024", "a.mxf.part"),
+        )
+        videos = [
+            name
+            for _, _, names in os.walk(self.local_dir)
+            for name in names
+            if name.endswith(".mxf")
+        ]
+        self.assertEqual(videos, [])
+        # Kept for the resume
+        main.remove_stale_staging()
+        self.assertTrue(os.path.exists(staged_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import contextlib
+import ftplib
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import main
+from main import VideoStatus
+from tests.support import configure, ftp_server, open_catalog
+
+
+class RefusingClient:
+    """An FTP client whose every command fails with 550."""
+
+    def __getattr__(self, name):
+        def refuse(*args, **kwargs):
+            raise ftplib.error_perm("550 Refused")
+
+        return refuse
+
+
+class RemoteUnchangedTest(unittest.TestCase):
+    def setUp(self):
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(local_dir.cleanup)
+        configure(LOCAL_DIR=local_dir.name, REMOTE_DIR="MXF")
+        self.conn = open_catalog()
+        self.addCleanup(self.conn.close)
+        main.set_sync_state("remote_fingerprint", "1:20240101120000:abc")
+
+    def add_row(self, status: int):
+        self.conn.execute(
+            "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES ('a.mxf', ?, 1)",
+            (status,),
+        )
+
+    def test_same_fingerprint_and_nothing_pending(self):
+        self.add_row(VideoStatus.DOWNLOADED)
+        self.assertTrue(main.remote_unchanged("1:20240101120000:abc"))
+        self.assertFalse(main.remote_unchanged("1:20240101120001:abc"))
+
+    def test_pending_rows(self):
+        for status in (
+            VideoStatus.NOT_DOWNLOADED,
+            VideoStatus.UPDATED,
+            VideoStatus.DELETED,
+            VideoStatus.PARTIAL,
+        ):
+            self.conn.execute("DELETE FROM videos")
+            self.add_row(status)
+            self.assertFalse(main.remote_unchanged("1:20240101120000:abc"), status)
+
+    def test_failed_transfer_is_reported(self):
+        self.add_row(VideoStatus.NOT_DOWNLOADED)
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(main.mirror_ftp_directory(RefusingClient()))
+        self.assertFalse(main.remote_unchanged("1:20240101120000:abc"))
+
+
+class SkipUnchangedScansTest(unittest.TestCase):
+    """Runs the cycles of the main loop against a local pyftpdlib server."""
+
+    def setUp(self):
+        remote_root = tempfile.TemporaryDirectory()
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(remote_root.cleanup)
+        self.addCleanup(local_dir.cleanup)
+        self.remote_dir = os.path.join(remote_root.name, "MXF")
+        for folder in ("2024", "2025"):
+            os.makedirs(os.path.join(self.remote_dir, folder))
+            for i in range(2):
+                self.write_remote(f"{folder}/f{i}.mxf", b"x" * i)
+        configure(LOCAL_DIR=local_dir.name, RECURSIVE=True, SKIP_UNCHANGED_SCANS=True)
+        main.local_index = None
+        self.conn = open_catalog()
+        self.addCleanup(self.conn.close)
+        server = ftp_server(remote_root.name, "MXF")
+        server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+
+    def write_remote(self, name: str, data: bytes):
+        with open(os.path.join(self.remote_dir, name), "wb") as f:
+            f.write(data)
+
+    def cycle(self) -> tuple[bool, int]:
+        """One cycle of the main loop: whether it mirrored, and how many
+        listings it sent."""
+        listings = []
+        iter_lines = main.iter_lines
+
+        def counting_iter_lines(ftp_client, command):
+            listings.append(command)
+            return iter_lines(ftp_client, command)
+
+        ftp = main.connect_ftp()
+        with mock.patch.object(main, "iter_lines", counting_iter_lines):
+            local_files = main.local_snapshot()
+            fingerprint = main.scan_remote(ftp, main.REMOTE_DIR, local_files)
+            mirrored = not main.remote_unchanged(fingerprint)
+            if mirrored:
+                main.scan_local(local_files)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertTrue(main.mirror_ftp_directory(ftp))
+                main.set_sync_state("remote_fingerprint", fingerprint)
+        ftp.quit()
+        return mirrored, len(listings)
+
+    def test_one_listing_per_directory_per_cycle(self):
+        # The root, 2024 and 2025
+        self.assertEqual(self.cycle(), (True, 3))
+        self.assertEqual(self.cycle(), (False, 3))
+        self.write_remote("2025/f0.mxf", b"changed")
+        self.assertEqual(self.cycle(), (True, 3))
+        with open(os.path.join(main.LOCAL_DIR, "2025", "f0.mxf"), "rb") as f:
+            self.assertEqual(f.read(), b"changed")
+        self.assertEqual(self.cycle(), (False, 3))
+
+
+class NextCycleDelayTest(unittest.TestCase):
+    def setUp(self):
+        configure(ADAPTIVE_POLLING=True, RECURSIVE=True)
+        self.conn = open_catalog()
+        self.addCleanup(self.conn.close)
+        # Every folder is cold
+        self.conn.execute(
+            "INSERT INTO remote_dirs (dir_path, next_poll) VALUES ('', ?)",
+            (time.time() + 86400,),
+        )
+
+    def test_cold_folders(self):
+        self.assertGreater(main.next_cycle_delay(), 80000)
+
+    def test_pending_rows_are_retried_every_interval(self):
+        self.conn.execute(
+            "INSERT INTO videos (video_id, video_status, video_remote_size) VALUES ('a.mxf', ?, 1)",
+            (VideoStatus.PARTIAL,),
+        )
+        self.assertEqual(main.next_cycle_delay(), main.INTERVAL_TIME)
+
+    def test_failed_cycle_is_retried_every_interval(self):
+        self.assertEqual(main.next_cycle_delay(False), main.INTERVAL_TIME)
+
+
+if __name__ == "__main__":
+    unittest.main()